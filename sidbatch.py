@@ -0,0 +1,244 @@
+'''
+###  sidbatch.py
+###  Sort the data of many observers in one run
+###
+###**************************
+###  Usage: py sidbatch.py -c=observers.ini -o=./output_path -p 4
+###  py sidbatch.py -h (command line help)
+###
+###  The configuration file lists each observer in a [section] of its own,
+###  with the folders their files come in and the rule table for the names:
+###    long  - UTYYYYMMDD..._VLF_[Name] as vsidsort.py makes them
+###    short - UTYYMMDD..._VLF_[Name] as sidsort.py makes them, but with
+###            the observer's name on .spd files too, where sidsort.py has
+###            always put CClements
+###  Anything in [DEFAULT] applies to every observer. For example:
+###
+###    [DEFAULT]
+###    output = D:/SID/sorted
+###    rules = long
+###
+###    [JCook]
+###    input = D:/SID/incoming/jcook
+###    rules = short
+###
+###    [SDawes]
+###    input = D:/SID/incoming/sdawes
+###            D:/SID/incoming/sdawes-old
+###
+###  Every input folder is sorted in a process of its own, up to -p at once,
+###  all into the same output folder. The output folder is looked at once
+###  and what was found is handed to every process, and they all share the
+###  index of sorted files kept there. One report covering every observer is
+###  printed at the end, and can be saved as JSON with --metrics-json.
+###
+###**************************
+'''
+import os, datetime, time
+import argparse
+import configparser
+import logging
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import sidcopy
+import sidmetrics
+import sidplan
+import sidsort
+
+version = '1.0'
+
+log = logging.getLogger('sidbatch')
+
+# the output directories known to exist, handed to each process by StartWorker
+Dirs = None
+
+
+def ReadConfig(path, outdir=None):
+    '''
+    Read the observers from the configuration file at path.
+    Returns a list of (observer, input folder, rule table name, output folder)
+    in the order they are in the file. outdir, if given, is used in place of
+    the output folder in the file. Raises ValueError for a bad file.
+    '''
+    config = configparser.ConfigParser()
+    if not config.read(path, encoding='utf-8'):
+        raise ValueError('Cannot read configuration file {}'.format(path))
+    jobs = []
+    for observer in config.sections():
+        section = config[observer]
+        output = outdir or section.get('output')
+        if not output:
+            raise ValueError('No output folder for {}'.format(observer))
+        rules = section.get('rules', 'short')
+        if rules not in sidplan.RuleTables:
+            raise ValueError('Unknown rules {} for {}, use one of {}'.format(
+                rules, observer, ', '.join(sidplan.RuleTables)))
+        inputs = section.get('input', '').split()
+        if not inputs:
+            raise ValueError('No input folder for {}'.format(observer))
+        for indir in inputs:
+            jobs.append((observer, indir, rules, output))
+    return jobs
+
+
+def StartWorker(known):
+    '''Runs once in each process, with the output directories found by the parent.'''
+    global Dirs
+    Dirs = sidcopy.DirCache(known=known)
+
+
+class Collector(logging.Handler):
+    '''Keeps each message as (level, text), to be sent back to the parent process.'''
+
+    def __init__(self, lines):
+        logging.Handler.__init__(self)
+        self.lines = lines
+
+    def emit(self, record):
+        self.lines.append((record.levelno, record.getMessage()))
+
+
+def SortObserver(observer, indir, rules, outdir, workers, rescan, mode, verify, on_conflict, convert, quicklook,
+                 bundle, listing):
+    '''
+    Sort one observer's input folder with sidsort.sort_tree. Runs in a worker process.
+    Returns a dict of the results, with the messages for the report in 'lines'.
+    '''
+    lines = []
+    logger = logging.getLogger('sidbatch.observer')
+    logger.propagate = False
+    logger.handlers = [Collector(lines)]
+    logger.setLevel(logging.DEBUG if listing else logging.INFO)
+    if not os.path.isdir(indir):
+        # reported like sidsort.py does; anything that goes wrong in the sort is a failed job
+        lines.append((logging.ERROR, 'Input Directory does not exist: {}'.format(indir)))
+        return {'observer': observer, 'input': indir, 'copied': 0, 'unchanged': 0,
+                'lines': lines, 'metrics': sidmetrics.Metrics().as_dict()}
+    result = sidsort.sort_tree(indir, outdir, observer=observer, rules=rules, workers=workers,
+                               rescan=rescan, mode=mode, verify=verify, on_conflict=on_conflict,
+                               convert=convert, quicklook=quicklook, bundle=bundle, logger=logger,
+                               dirs=Dirs)
+    result.metrics.finish()
+    return {'observer': observer, 'input': indir, 'copied': result.copied, 'unchanged': result.unchanged,
+            'lines': lines, 'metrics': result.metrics.as_dict()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sort the SID data of many observers in one run')
+    parser.add_argument('-c', '--config', dest='config', required=True,
+                        help='Configuration file listing the observers and their input folders')
+    parser.add_argument('-o', '--o', dest='outdir',
+                        help='Output files directory, in place of the one in the configuration file')
+    parser.add_argument('-p', '--processes', dest='processes', type=int, default=os.cpu_count() or 1,
+                        help='Number of input folders to sort at once, default is the number of CPUs')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=1,
+                        help='Number of directories to list and files to copy at once in each process, '
+                             'default is 1')
+    parser.add_argument('--rescan', dest='rescan', action='store_true',
+                        help='Re-check every input file, not just new or changed ones')
+    parser.add_argument('-m', '--mode', dest='mode', choices=sidcopy.Modes, default='copy',
+                        help='copy, hardlink, reflink or move the files, default is copy')
+    parser.add_argument('--verify', dest='verify', action='store_true',
+                        help='Compare file contents as well as names, as sidsort.py --verify')
+    parser.add_argument('--on-conflict', dest='onconflict', choices=sidcopy.Conflicts, default='flag',
+                        help='With --verify, flag or version files that differ, default is flag')
+    parser.add_argument('--convert', dest='convert', action='store_true',
+                        help='Also write the data of each observer and day that gets new files as .npy files, '
+                             'see sidconvert.py')
+    parser.add_argument('--quicklook', dest='quicklook', action='store_true',
+                        help='Also convert, and write a quicklook summary of, each day that gets new files, '
+                             'see sidquicklook.py - needs NumPy')
+    parser.add_argument('--bundle', dest='bundle', choices=('zip', 'tar.gz', 'tar.zst'),
+                        help='Also write the files of each observer and day that gets new files into one archive, '
+                             'see sidbundle.py - tar.zst needs zstandard')
+    parser.add_argument('--log-level', dest='loglevel', default='INFO',
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help='DEBUG lists every file, INFO only the totals, '
+                             'WARNING only problems, default is INFO')
+    parser.add_argument('--metrics-json', dest='metricsjson',
+                        help='Save counts and timings of the run, for each observer and in total, to this JSON file')
+    args = parser.parse_args(argv)
+    if args.quicklook:
+        import sidquicklook
+        if sidquicklook.numpy is None:
+            parser.error('--quicklook needs NumPy: pip install numpy')
+    if args.bundle == 'tar.zst':
+        import sidbundle
+        if sidbundle.zstandard is None:
+            parser.error('--bundle tar.zst needs Zstandard: pip install zstandard')
+    logging.basicConfig(stream=sys.stdout, format='%(message)s', level=args.loglevel)
+
+    StartTime = time.time()
+    log.info('Sidbatch version %s started %s', version, datetime.datetime.now().time())
+    try:
+        jobs = ReadConfig(args.config, args.outdir)
+    except (ValueError, configparser.Error) as e:
+        log.error('%s', e)
+        return 1
+    observers = list(dict.fromkeys(job[0] for job in jobs))
+    log.info('%s observers, %s input folders', len(observers), len(jobs))
+
+    # each output folder is looked at once here rather than once in every process
+    known = set()
+    for outdir in sorted({job[3] for job in jobs}):
+        if not os.path.exists(outdir):
+            log.info("Output directory %s doesn't exist so creating it....", outdir)
+            os.makedirs(outdir)
+        known |= sidcopy.DirCache(outdir).known
+
+    listing = log.isEnabledFor(logging.DEBUG)
+    Total = sidmetrics.Metrics()
+    results = []
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.processes), initializer=StartWorker,
+                             initargs=(known,)) as pool:
+        futures = {pool.submit(SortObserver, observer, indir, rules, outdir, args.workers, args.rescan,
+                               args.mode, args.verify, args.onconflict, args.convert,
+                               args.quicklook, args.bundle, listing): (observer, indir)
+                   for observer, indir, rules, outdir in jobs}
+        for future in as_completed(futures):
+            observer, indir = futures[future]
+            try:
+                result = future.result()
+            except Exception:
+                failed += 1
+                log.error('Sorting %s from %s failed:\n%s', observer, indir, traceback.format_exc())
+                continue
+            for level, line in result['lines']:
+                log.log(level, '%s: %s', observer, line)
+            if any(level >= logging.ERROR for level, line in result['lines']):
+                failed += 1
+            log.info('%s: %s copied, %s unchanged from %s', observer, result['copied'],
+                     result['unchanged'], indir)
+            Total.merge(result['metrics'])
+            results.append(result)
+    Total.finish()
+
+    # the combined report, observers in the order of the configuration file
+    EndTime = time.time()
+    log.info('Sidbatch finished at %s', datetime.datetime.now().time())
+    for observer in observers:
+        mine = [result for result in results if result['observer'] == observer]
+        log.info('%-12s files copied = %s, unchanged = %s', observer,
+                 sum(result['copied'] for result in mine), sum(result['unchanged'] for result in mine))
+    for line in Total.summary():
+        log.info(line)
+    log.info('Unchanged files passed over = %s', sum(result['unchanged'] for result in results))
+    log.info('Files copied = %s in %.3f seconds', sum(result['copied'] for result in results),
+             EndTime - StartTime)
+    if args.metricsjson:
+        Total.save(args.metricsjson, version=version, config=args.config, mode=args.mode,
+                   processes=args.processes, workers=args.workers,
+                   observers=[{key: result[key] for key in ('observer', 'input', 'copied', 'unchanged', 'metrics')}
+                              for result in results])
+        log.info('Run statistics saved to %s', args.metricsjson)
+    if failed:
+        log.error('%s input folders could not be sorted', failed)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,332 @@
+'''
+###  sidbench.py
+###  Benchmark for the sort engine, run on a made up SID archive
+###
+###**************************
+###  Usage: py sidbench.py -d=./bench -w 1 4 -m copy hardlink --json=results.json
+###  py sidbench.py -h (command line help)
+###
+###  Makes an input tree of .dat, .spd, Staribus .xml and UKRAA .csv files
+###  (and optionally monthly .zip files of .spd data) under the work folder,
+###  then sorts it once for every mode and worker count given, each in a
+###  fresh process, through sidsort.sort_tree as sidsort.py and vsidsort.py do,
+###  so -w sets the folders listed at once as well as the copy workers.
+###  For every run it reports files/sec, MB/s, the time in each phase of the
+###  sort, the number of file system calls made, and the peak memory use. Each run also sorts the same tree a
+###  second time to time a re-run, where the index should skip everything.
+###
+###  Results can be saved as JSON, and compared with an earlier file to
+###  catch slowdowns:
+###  py sidbench.py --json=new.json --compare=old.json
+###
+###**************************
+'''
+import os, datetime, time
+import argparse
+import builtins
+import json
+import multiprocessing
+import platform
+import shutil
+import sys
+import threading
+import zipfile
+from collections import Counter
+
+import sidcopy
+import sidmetrics
+import sidplan
+import sidsort
+
+# os functions counted during a run, wrapped by CountCalls, along with open()
+CountedCalls = ('stat', 'lstat', 'scandir', 'listdir', 'mkdir', 'link',
+                'rename', 'replace', 'unlink', 'copy_file_range', 'sendfile')
+
+
+def Clock(i, n):
+    '''HHMMSS of the i-th of n times spread evenly over a day.'''
+    seconds = i * 86400 // n
+    return '{:02d}{:02d}{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def MakeArchive(root, days=60, dat=1, spd=1, xml=24, csv=24, size=4096, depth=2,
+                zips=False, start=datetime.date(2019, 1, 1), observer='Bench'):
+    '''
+    Make a made up observer archive under root and return (files, bytes).
+        days    - number of consecutive days of data
+        dat/spd - files per day of each kind
+        xml/csv - files per day of each kind, spread evenly over the day
+                  so each has a time of its own, at most one a second
+        size    - bytes in each file
+        depth   - 0 puts everything in root, 1 adds a year folder,
+                  2 a year and month folder, 3 a folder per day as well
+        zips    - put each month's .spd files in one .zip instead
+    '''
+    if max(xml, csv) > 86400:
+        raise ValueError('At most 86400 .xml and .csv files a day, one a second')
+    # data lines of text, so compressed zips behave roughly like real ones
+    line = b'00:00:00, 12345, 23456, 34567, 45678\n'
+    payload = (line * (size // len(line) + 1))[:size]
+    files = 0
+    nbytes = 0
+    archives = {}
+    try:
+        for n in range(days):
+            day = start + datetime.timedelta(days=n)
+            parts = [root, day.strftime('%Y'), day.strftime('%m'), day.strftime('%d')][:depth + 1]
+            folder = os.path.join(*parts)
+            os.makedirs(folder, exist_ok=True)
+            names = []
+            for i in range(dat):
+                names.append('{}_{:02d}.dat'.format(day.strftime('%Y%m%d'), i))
+            for i in range(xml):
+                names.append('Staribus4ChannelLogger_RawData_{}_{}.xml'.format(day.strftime('%Y%m%d'), Clock(i, xml)))
+            for i in range(csv):
+                names.append('UT{}_{}_UKRAA_Rx_VLF_{}.csv'.format(day.strftime('%Y%m%d'), Clock(i, csv), observer))
+            spds = ['UT{}_{:02d}.spd'.format(day.strftime('%y%m%d'), i) for i in range(spd)]
+            if zips:
+                key = day.strftime('%Y%m')
+                if key not in archives:
+                    archives[key] = zipfile.ZipFile(os.path.join(folder, '{}_spd.zip'.format(key)),
+                                                    'w', zipfile.ZIP_DEFLATED)
+                for name in spds:
+                    archives[key].writestr('{}/{}'.format(day.strftime('%d'), name), payload)
+                    files += 1
+                    nbytes += size
+            else:
+                names.extend(spds)
+            for name in names:
+                with open(os.path.join(folder, name), 'wb') as f:
+                    f.write(payload)
+                files += 1
+                nbytes += size
+    finally:
+        for Archive in archives.values():
+            Archive.close()
+    return files, nbytes
+
+
+def CountCalls(counts):
+    '''
+    Wrap the os functions in CountedCalls, and the built in open(), so each
+    call adds one to counts. Returns a function that puts the originals back.
+    '''
+    lock = threading.Lock()
+    originals = {}
+
+    def Wrap(name, function):
+        def Counted(*args, **kwargs):
+            with lock:
+                counts[name] += 1
+            return function(*args, **kwargs)
+        return Counted
+
+    for name in CountedCalls:
+        if hasattr(os, name):
+            originals[name] = getattr(os, name)
+            setattr(os, name, Wrap(name, originals[name]))
+
+    builtin_open = builtins.open
+    builtins.open = Wrap('open', builtin_open)
+
+    def Restore():
+        for name, function in originals.items():
+            setattr(os, name, function)
+        builtins.open = builtin_open
+    return Restore
+
+
+def ReadProcIO():
+    '''Read and write system call counts from /proc (Linux only), or {}.'''
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(': ') for line in f)}
+    except OSError:
+        return {}
+
+
+def PeakRSS():
+    '''Peak resident memory of this process in KB, or None where unknown.'''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux KB
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def SortOnce(indir, outdir, mode, workers, rules):
+    '''
+    Sort indir into outdir with sidsort.sort_tree, as the scripts do, and
+    return the timings.
+    '''
+    counts = Counter()
+    Metrics = sidmetrics.Metrics()
+    # the plan is known when sort_tree first reports progress
+    planned = []
+
+    def Progress(done, total):
+        if not planned:
+            planned.append(time.perf_counter())
+
+    io_before = ReadProcIO()
+    Restore = CountCalls(counts)
+    try:
+        StartTime = time.perf_counter()
+        result = sidsort.sort_tree(indir, outdir, 'Bench', rules, workers=workers, mode=mode,
+                                   progress=Progress, metrics=Metrics)
+        EndTime = time.perf_counter()
+    finally:
+        Restore()
+    io_after = ReadProcIO()
+    PlanTime = planned[0] if planned else EndTime
+    return {
+        'files': result.copied,
+        'unchanged': result.unchanged,
+        'bytes': Metrics.counts['bytes'],
+        'plan_seconds': PlanTime - StartTime,
+        'copy_seconds': EndTime - PlanTime,
+        'seconds': EndTime - StartTime,
+        'phases': Metrics.as_dict()['phases'],
+        'calls': dict(counts),
+        'io': {key: io_after[key] - io_before.get(key, 0) for key in io_after},
+        }
+
+
+def RunOne(indir, outdir, mode, workers, long_years, results):
+    '''
+    One benchmark run, in its own process so that peak memory is its own.
+    '''
+    rules = sidplan.LongYearRules if long_years else sidplan.ShortYearRules
+    try:
+        first = SortOnce(indir, outdir, mode, workers, rules)
+        rerun = SortOnce(indir, outdir, mode, workers, rules)
+    except Exception:
+        # hand the error back rather than leave the parent waiting
+        import traceback
+        results.put({'error': traceback.format_exc()})
+        return
+    first['files_per_sec'] = first['files'] / first['seconds'] if first['seconds'] else 0
+    first['mb_per_sec'] = first['bytes'] / 1e6 / first['seconds'] if first['seconds'] else 0
+    first['rerun_seconds'] = rerun['seconds']
+    first['rerun_calls'] = rerun['calls']
+    first['peak_rss_kb'] = PeakRSS()
+    results.put(first)
+
+
+def Compare(runs, old, threshold):
+    '''
+    Print the change in files/sec against the runs in an earlier results
+    file. Returns the number of runs slower by more than threshold percent.
+    '''
+    before = {(run['mode'], run['workers']): run for run in old['runs']}
+    slower = 0
+    for run in runs:
+        was = before.get((run['mode'], run['workers']))
+        if was is None or not was['files_per_sec']:
+            continue
+        change = (run['files_per_sec'] / was['files_per_sec'] - 1) * 100
+        flag = ''
+        if change < -threshold:
+            flag = '  <-- slower'
+            slower += 1
+        print('{:>8} x{:<3} {:10.0f} files/s was {:10.0f} ({:+.1f}%){}'.format(
+            run['mode'], run['workers'], run['files_per_sec'], was['files_per_sec'], change, flag))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the SID sort engine on a made up archive')
+    parser.add_argument('-d', '--dir', dest='workdir', default='./sidbench-work',
+                        help='New or empty work folder for the made up archive, default is ./sidbench-work')
+    parser.add_argument('--days', type=int, default=60, help='Days of data, default is 60')
+    parser.add_argument('--dat', type=int, default=1, help='.dat files per day, default is 1')
+    parser.add_argument('--spd', type=int, default=1, help='.spd files per day, default is 1')
+    parser.add_argument('--xml', type=int, default=24, help='Staribus .xml files per day, default is 24')
+    parser.add_argument('--csv', type=int, default=24, help='UKRAA .csv files per day, default is 24')
+    parser.add_argument('--size', type=int, default=4096, help='Bytes per file, default is 4096')
+    parser.add_argument('--depth', type=int, default=2, choices=range(4),
+                        help='Folder nesting of the input, 0 to 3, default is 2')
+    parser.add_argument('--zips', action='store_true', help='Put each month of .spd files in a .zip')
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1],
+                        help='Worker counts to try, default is 1')
+    parser.add_argument('-m', '--modes', nargs='+', choices=sidcopy.Modes, default=['copy'],
+                        help='Copy modes to try, default is copy')
+    parser.add_argument('--short-years', dest='long_years', action='store_false',
+                        help="Use sidsort.py's UTYYMMDD rules rather than vsidsort.py's")
+    parser.add_argument('--json', dest='jsonfile', help='Save the results to this file')
+    parser.add_argument('--compare', help='Earlier results file to compare files/sec against')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='Percent drop in files/sec that counts as slower, default is 10')
+    parser.add_argument('--keep', action='store_true', help='Leave the work folder in place afterwards')
+    args = parser.parse_args(argv)
+
+    source = os.path.join(args.workdir, 'input')
+    # only a folder made here, or one that was empty, is cleared afterwards
+    made = not os.path.exists(args.workdir)
+    if not made and (not os.path.isdir(args.workdir) or os.listdir(args.workdir)):
+        parser.error('Work folder {} is not empty, give a new or empty one'.format(args.workdir))
+    settings = dict(days=args.days, dat=args.dat, spd=args.spd, xml=args.xml, csv=args.csv,
+                    size=args.size, depth=args.depth, zips=args.zips)
+    files, nbytes = MakeArchive(source, **settings)
+    print('Made {} files, {:.1f} MB in {}'.format(files, nbytes / 1e6, source))
+
+    runs = []
+    try:
+        for mode in args.modes:
+            for workers in args.workers:
+                outdir = os.path.join(args.workdir, 'output-{}-{}'.format(mode, workers))
+                indir = source
+                if mode == 'move':
+                    # move empties the input, so each run needs its own copy
+                    indir = os.path.join(args.workdir, 'input-{}'.format(workers))
+                    shutil.copytree(source, indir)
+                results = multiprocessing.Queue()
+                worker = multiprocessing.Process(target=RunOne,
+                                                 args=(indir, outdir, mode, workers, args.long_years, results))
+                worker.start()
+                run = results.get()
+                worker.join()
+                if 'error' in run:
+                    raise RuntimeError('{} x{} run failed:\n{}'.format(mode, workers, run['error']))
+                run.update(mode=mode, workers=workers)
+                runs.append(run)
+                print('{:>8} x{:<3} {:8d} files {:8.3f} s {:10.0f} files/s {:8.1f} MB/s  '
+                      're-run {:.3f} s  {} fs calls  peak {} KB'.format(
+                          mode, workers, run['files'], run['seconds'], run['files_per_sec'],
+                          run['mb_per_sec'], run['rerun_seconds'], sum(run['calls'].values()),
+                          run['peak_rss_kb']))
+                shutil.rmtree(outdir)
+                if indir != source:
+                    shutil.rmtree(indir)
+    finally:
+        if not args.keep and made:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+        elif not args.keep:
+            # it was empty, so everything in it is the benchmark's
+            for name in os.listdir(args.workdir):
+                shutil.rmtree(os.path.join(args.workdir, name), ignore_errors=True)
+
+    report = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'archive': dict(settings, files=files, bytes=nbytes),
+        'runs': runs,
+        }
+    if args.jsonfile:
+        with open(args.jsonfile, mode='wt', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print('Results saved to {}'.format(args.jsonfile))
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            old = json.load(f)
+        if Compare(runs, old, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+'''
+###  sidbundle.py
+###  Bundle each observer's sorted files for a day into one archive
+###
+###**************************
+###  Usage: py sidbundle.py -o=./output_path -f zip -p 4
+###  py sidbundle.py -h (command line help)
+###  or sidsort.py --bundle zip to bundle the days that get new files as they are sorted.
+###
+###  The .dat, .spd, .csv and .xml files of each observer in each
+###  YYYY/YYMM/YYMMDD day folder are written into one archive in the same
+###  folder, named to the same convention as the files:
+###    UT20190101_VLF_JCook.zip     - zip, deflated
+###    UT20190101_VLF_JCook.tar.gz  - tar, gzip
+###    UT20190101_VLF_JCook.tar.zst - tar, Zstandard - needs the zstandard
+###                                   package: pip install zstandard
+###  so the portal takes in one file per observer and day rather than
+###  thousands of small ones. The files are streamed into the archive in
+###  chunks, never read whole, and are left where they are: the index of
+###  sorted files, --verify and sidconvert.py all go on using them.
+###
+###  Each day is compressed in a process of its own, up to -p at once.
+###  When new files arrive for a day that already has a bundle, a zip has
+###  just the new files added to it. A tar can not be added to once it is
+###  compressed, so it is written again. A day whose bundle already holds
+###  every file, at the same size, is passed over. After writing a bundle
+###  the day is looked at again, and the bundle written again if another
+###  job sorting the same observer, such as a second input folder in
+###  sidbatch.py, has added a file or replaced it with one short of a file.
+###
+###**************************
+'''
+import os, datetime, time
+import argparse
+import shutil
+import sys
+import tarfile
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import sidconvert
+import sidcopy
+
+Formats = ('zip', 'tar.gz', 'tar.zst')
+# the sorted files that go in a bundle
+Suffixes = ('dat', 'spd', 'csv', 'xml')
+
+
+def Groups(daydir):
+    '''
+    The sorted files in a day folder that go in a bundle, by observer:
+    {observer: [file names]}. Files kept as _v2, _v3... go in with the rest.
+    '''
+    groups = defaultdict(list)
+    try:
+        files = sorted(os.listdir(daydir))
+    except OSError:
+        return groups
+    for file in files:
+        match = sidconvert.SortedName.match(file)
+        if match is not None and match.group('suffix') in Suffixes:
+            groups[match.group('observer')].append(file)
+    return groups
+
+
+def BundlePath(daydir, observer, format):
+    '''Where the bundle of one observer's files for a day goes, or None if daydir is not a day folder.'''
+    midnight = sidconvert.Midnight(daydir)
+    if midnight is None:
+        return None
+    return os.path.join(daydir, 'UT{}_VLF_{}.{}'.format(
+        time.strftime('%Y%m%d', time.gmtime(midnight)), observer, format))
+
+
+def OpenTar(path, mode, zst=None):
+    '''
+    A tar streamed to or from path, with the file underneath it. mode is
+    'r' or 'w'. It is compressed with Zstandard if zst is True, or if zst is
+    None and the name ends .zst, else with gzip.
+    '''
+    if zst is None:
+        zst = path.endswith('.zst')
+    f = open(path, mode + 'b')
+    try:
+        if zst:
+            if mode == 'r':
+                stream = zstandard.ZstdDecompressor().stream_reader(f)
+            else:
+                stream = zstandard.ZstdCompressor().stream_writer(f)
+            return tarfile.open(fileobj=stream, mode=mode + '|'), stream, f
+        return tarfile.open(fileobj=f, mode=mode + '|gz'), None, f
+    except BaseException:
+        f.close()
+        raise
+
+
+def CloseTar(tar, stream, f):
+    tar.close()
+    if stream is not None:
+        stream.close()
+    f.close()
+
+
+def Members(path):
+    '''{name: size} of the files in a bundle, empty if there is none.'''
+    if not os.path.isfile(path):
+        return {}
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as bundle:
+            return {info.filename: info.file_size for info in bundle.infolist()}
+    tar, stream, f = OpenTar(path, 'r')
+    try:
+        return {info.name: info.size for info in tar}
+    finally:
+        CloseTar(tar, stream, f)
+
+
+def WriteBundle(path, daydir, files, old):
+    '''
+    Write the bundle at path again from files in daydir, keeping anything
+    in the old one that is no longer in the folder. It is written to a
+    temporary name first, so a reader never sees half a bundle.
+    '''
+    kept = [name for name in old if name not in files]
+
+    def write(temp):
+        if path.endswith('.zip'):
+            with zipfile.ZipFile(temp, 'w', zipfile.ZIP_DEFLATED) as bundle:
+                if kept:
+                    with zipfile.ZipFile(path) as previous:
+                        for name in kept:
+                            with previous.open(name) as source, bundle.open(previous.getinfo(name), 'w') as target:
+                                shutil.copyfileobj(source, target)
+                for file in files:
+                    bundle.write(os.path.join(daydir, file), file)
+            return
+        tar, stream, f = OpenTar(temp, 'w', path.endswith('.zst'))
+        try:
+            if kept:
+                previous = OpenTar(path, 'r')
+                try:
+                    for info in previous[0]:
+                        if info.name in kept:
+                            tar.addfile(info, previous[0].extractfile(info))
+                finally:
+                    CloseTar(*previous)
+            for file in files:
+                tar.add(os.path.join(daydir, file), file)
+        finally:
+            CloseTar(tar, stream, f)
+    sidcopy.Atomic(write, path)
+
+
+def AppendZip(path, daydir, files):
+    '''
+    Add files to the zip at path. The zip is copied, not compressed again,
+    and the copy added to and put in its place, so a reader never sees half
+    a bundle.
+    '''
+    def write(temp):
+        shutil.copyfile(path, temp)
+        with zipfile.ZipFile(temp, 'a', zipfile.ZIP_DEFLATED) as bundle:
+            for file in files:
+                bundle.write(os.path.join(daydir, file), file)
+    sidcopy.Atomic(write, path)
+
+
+def BundleDay(daydir, format='zip', only=None):
+    '''
+    Bring the bundles in a YYMMDD folder up to date with its files. With
+    only, a set of file names, just the observers with one of those files
+    are looked at. Returns the number of bundles written.
+    '''
+    if sidconvert.Midnight(daydir) is None:
+        return 0
+    bundled = 0
+    for observer, files in Groups(daydir).items():
+        if only is not None and not only.intersection(files):
+            continue
+        path = BundlePath(daydir, observer, format)
+        written = False
+        while True:
+            old = Members(path)
+            sizes = {file: os.stat(os.path.join(daydir, file)).st_size for file in files}
+            new = [file for file in files if old.get(file) != sizes[file]]
+            if not new:
+                break
+            if old and path.endswith('.zip') and not any(file in old for file in new):
+                AppendZip(path, daydir, new)
+            else:
+                WriteBundle(path, daydir, files, old)
+            written = True
+            # another job sorting the same observer may have added a file
+            # since the folder was listed, or put its own bundle over this
+            # one; if so it is done again
+            files = Groups(daydir).get(observer, [])
+        bundled += written
+    return bundled
+
+
+def BundleDays(days, format='zip', processes=1):
+    '''
+    Bundle days, a list of day folders or of (day folder, set of file names)
+    as BundleDay takes them, with up to processes days at once.
+    Returns the number of bundles written.
+    '''
+    days = [day if isinstance(day, tuple) else (day, None) for day in days]
+    if processes <= 1 or len(days) <= 1:
+        return sum(BundleDay(daydir, format, only) for daydir, only in days)
+    with ProcessPoolExecutor(max_workers=min(processes, len(days))) as pool:
+        return sum(pool.map(BundleDay, [daydir for daydir, only in days], [format] * len(days),
+                            [only for daydir, only in days]))
+
+
+def BundleCopied(copied, format='zip', processes=1):
+    '''
+    Bundle the days that files have just been copied into.
+    copied is a list of (NewDir, NewFileName). Returns the number of bundles written.
+    '''
+    days = defaultdict(set)
+    for NewDir, NewFileName in copied:
+        days[NewDir].add(NewFileName)
+    return BundleDays(sorted(days.items()), format, processes)
+
+
+def Check(format):
+    '''Raises ValueError for an unknown format, or ImportError if it cannot be written here.'''
+    if format not in Formats:
+        raise ValueError('Unknown bundle format {}, use one of {}'.format(format, ', '.join(Formats)))
+    if format == 'tar.zst' and zstandard is None:
+        raise ImportError('tar.zst bundles need Zstandard: pip install zstandard')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bundle the sorted SID data files of each observer and day '
+                                                 'into one archive')
+    parser.add_argument('-o', '--o', dest='outdir', default='./',
+                        help='Sorted files directory default is ./')
+    parser.add_argument('-f', '--format', dest='format', choices=Formats, default='zip',
+                        help='zip, tar.gz or tar.zst (needs the zstandard package), default is zip')
+    parser.add_argument('-p', '--processes', dest='processes', type=int, default=os.cpu_count() or 1,
+                        help='Number of days to compress at once, default is the number of CPUs')
+    args = parser.parse_args(argv)
+    try:
+        Check(args.format)
+    except ImportError as e:
+        print(e)
+        return 1
+    StartTime = time.time()
+    print('Sidbundle started {}'.format(datetime.datetime.now().time()))
+    days = sidconvert.DayFolders(args.outdir)
+    bundled = BundleDays(days, args.format, args.processes)
+    print('{} bundles written in {} day folders in {:.3f} seconds'.format(
+        bundled, len(days), time.time() - StartTime))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
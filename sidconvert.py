@@ -0,0 +1,360 @@
+'''
+###  sidconvert.py
+###  Convert sorted SID data to one columnar format
+###
+###**************************
+###  Usage: py sidconvert.py -o=./output_path
+###  py sidconvert.py -h (command line help)
+###  or sidsort.py --convert to convert the days that get new files as they are sorted.
+###
+###  The .dat, .spd, Staribus .xml and UKRAA .csv files of each observer on
+###  each day in the sorted YYYY/YYMM/YYMMDD tree are read, one line at a
+###  time, into a pair of NumPy .npy files in the same day folder:
+###    UT20190101_VLF_JCook_dat.time.npy    - float64, seconds since 1970 UTC
+###    UT20190101_VLF_JCook_dat.values.npy  - float32, one row per channel
+###  so a day can be opened with numpy.load(path, mmap_mode='r') rather than
+###  parsed again. The .npy files are written with the standard library only;
+###  NumPy is not needed to make them.
+###
+###  Every line that starts with a time, HH:MM:SS on the day of the folder,
+###  a date and time, or seconds since 1970, followed by numbers, is a sample.
+###  Anything else, such as headings, is passed over. In .xml files the text
+###  of every element is read the same way. A channel missing from a line is
+###  stored as NaN.
+###
+###  A day is only converted again when one of its files is newer than the
+###  .npy files. Files kept as _v2, _v3... by --on-conflict version are left out.
+###  The files of a station-day are read one after another, one open at a
+###  time, and if more arrive while it is being converted, from another
+###  sidbatch job sorting the same observer, it is converted again.
+###
+###**************************
+'''
+import os, datetime, time
+import argparse
+import calendar
+import re
+import shutil
+import sys
+import tempfile
+import xml.etree.ElementTree as ElementTree
+from array import array
+from collections import defaultdict
+
+import sidcopy
+
+# samples held in memory before they are written to the temporary files
+CHUNK_ROWS = 65536
+
+# UT..._VLF_[Name].[Suffix] as made by sidplan's rules, with an optional _vN
+SortedName = re.compile(r'UT.*_VLF_(?P<observer>.+?)(?P<version>_v\d+)?\.(?P<suffix>[a-z]{3})$')
+DayFolder = re.compile(r'(?P<y>\d\d)(?P<M>\d\d)(?P<D>\d\d)$')
+Separator = re.compile(r'[,;\s]+')
+DateToken = re.compile(r'(?:(?P<Y>\d{4})-(?P<M>\d\d)-(?P<D>\d\d)|(?P<d>\d\d)/(?P<m>\d\d)/(?P<y>\d{4}))(?:T(?P<time>.*))?$')
+NaN = float('nan')
+
+
+def SecondsOfDay(text):
+    '''Seconds since midnight for HH:MM:SS or HH:MM:SS.sss'''
+    hours, minutes, seconds = text.rstrip('Z').split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def ParseLine(line, midnight):
+    '''
+    (time, [values]) for a line of data, or None if the line is not a sample.
+    midnight is the start of the day of the file in seconds since 1970.
+    '''
+    tokens = Separator.split(line.strip())
+    if not tokens[0]:
+        return None
+    try:
+        first = tokens[0]
+        date = DateToken.match(first)
+        if date is not None:
+            if date.group('Y'):
+                day = (int(date.group('Y')), int(date.group('M')), int(date.group('D')))
+            else:
+                day = (int(date.group('y')), int(date.group('m')), int(date.group('d')))
+            if date.group('time'):
+                clock = date.group('time')
+                rest = tokens[1:]
+            else:
+                clock = tokens[1]
+                rest = tokens[2:]
+            stamp = calendar.timegm(day + (0, 0, 0)) + SecondsOfDay(clock)
+        elif ':' in first:
+            stamp = midnight + SecondsOfDay(first)
+            rest = tokens[1:]
+        else:
+            # seconds since 1970, anything smaller is not a time
+            stamp = float(first)
+            if stamp < 1e8:
+                return None
+            rest = tokens[1:]
+        values = [float(token) for token in rest if token]
+    except (ValueError, IndexError):
+        return None
+    if not values:
+        return None
+    return stamp, values
+
+
+def TextRows(path, midnight):
+    '''The samples in a text file, one line at a time.'''
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            row = ParseLine(line, midnight)
+            if row is not None:
+                yield row
+
+
+def XmlRows(path, midnight):
+    '''The samples in the text of the elements of an XML file, such as a Staribus log.'''
+    # opened here so the file is closed as soon as the reader is
+    with open(path, 'rb') as f:
+        try:
+            for event, element in ElementTree.iterparse(f, events=('end',)):
+                if element.text:
+                    for line in element.text.splitlines():
+                        row = ParseLine(line, midnight)
+                        if row is not None:
+                            yield row
+                element.clear()
+        except ElementTree.ParseError:
+            # keep whatever came before a damaged or cut short part of the file
+            return
+
+
+Readers = {'dat': TextRows, 'spd': TextRows, 'csv': TextRows, 'xml': XmlRows}
+
+
+def NpyHeader(descr, shape):
+    '''The header of a version 1.0 .npy file, padded to 64 bytes as NumPy does.'''
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': {}, }}".format(
+        descr, '({},)'.format(shape[0]) if len(shape) == 1 else str(tuple(shape)))
+    pad = 64 - (10 + len(header) + 1) % 64
+    header = header + ' ' * pad + '\n'
+    return b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+
+class Columns:
+    '''
+    Samples streamed into one temporary file per column, so a day of any
+    size is converted in a fixed amount of memory.
+    '''
+
+    def __init__(self):
+        self.rows = 0
+        self.times = array('d')
+        self.timefile = tempfile.TemporaryFile()
+        # (values not yet written, temporary file) for each channel
+        self.channels = []
+
+    def add(self, stamp, values):
+        self.times.append(stamp)
+        while len(self.channels) < len(values):
+            # a channel first seen now is NaN for the samples before
+            column = tempfile.TemporaryFile()
+            self.write(column, array('f', [NaN]) * self.rows)
+            self.channels.append((array('f', [NaN]) * (len(self.times) - 1), column))
+        for i, (pending, column) in enumerate(self.channels):
+            pending.append(values[i] if i < len(values) else NaN)
+        if len(self.times) >= CHUNK_ROWS:
+            self.flush()
+
+    @staticmethod
+    def write(f, values):
+        if sys.byteorder != 'little':
+            values = array(values.typecode, values)
+            values.byteswap()
+        f.write(values.tobytes())
+
+    def flush(self):
+        self.write(self.timefile, self.times)
+        self.rows += len(self.times)
+        del self.times[:]
+        for pending, column in self.channels:
+            self.write(column, pending)
+            del pending[:]
+
+    def save(self, stem):
+        '''
+        Write stem.time.npy and stem.values.npy. Each is written to a
+        temporary name first, so a reader never sees half a file.
+        '''
+        self.flush()
+        self.timefile.seek(0)
+        self.Replace(stem + '.time.npy', NpyHeader('<f8', (self.rows,)), [self.timefile])
+        columns = [column for pending, column in self.channels]
+        for column in columns:
+            column.seek(0)
+        self.Replace(stem + '.values.npy', NpyHeader('<f4', (len(columns), self.rows)), columns)
+
+    @staticmethod
+    def Replace(path, header, sources):
+        def write(temp):
+            with open(temp, 'wb') as f:
+                f.write(header)
+                for source in sources:
+                    shutil.copyfileobj(source, f)
+        sidcopy.Atomic(write, path)
+
+    def close(self):
+        self.timefile.close()
+        for pending, column in self.channels:
+            column.close()
+
+
+def StationDays(daydir):
+    '''
+    The sorted files in one day folder that can be converted, grouped by
+    observer and suffix: {(observer, suffix): [file names]}
+    '''
+    groups = defaultdict(list)
+    try:
+        files = sorted(os.listdir(daydir))
+    except OSError:
+        return groups
+    for file in files:
+        match = SortedName.match(file)
+        if match is None or match.group('version') or match.group('suffix') not in Readers:
+            continue
+        groups[match.group('observer'), match.group('suffix')].append(file)
+    return groups
+
+
+def Midnight(daydir):
+    '''Start of the day of a YYMMDD folder, in seconds since 1970 UTC, or None.'''
+    match = DayFolder.match(os.path.basename(os.path.normpath(daydir)))
+    if match is None:
+        return None
+    try:
+        day = datetime.date(2000 + int(match.group('y')), int(match.group('M')), int(match.group('D')))
+    except ValueError:
+        return None
+    return calendar.timegm(day.timetuple())
+
+
+def Stale(stem, paths):
+    '''True if the .npy files for stem are missing or older than any of paths.'''
+    try:
+        made = min(os.stat(stem + '.time.npy').st_mtime_ns, os.stat(stem + '.values.npy').st_mtime_ns)
+    except OSError:
+        return True
+    return any(os.stat(path).st_mtime_ns > made for path in paths)
+
+
+def Modified(paths):
+    '''{path: modified time} of paths, None for one that has gone.'''
+    modified = {}
+    for path in paths:
+        try:
+            modified[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            modified[path] = None
+    return modified
+
+
+def ConvertStation(stem, paths, reader, midnight):
+    '''
+    Read paths with reader into stem.time.npy and stem.values.npy.
+    Returns True if there were any samples to write.
+    '''
+    # files are taken in the order of their first sample, whatever their
+    # names. Each is opened again to be read, so only one is open at a time.
+    firsts = []
+    for path in paths:
+        rows = reader(path, midnight)
+        first = next(rows, None)
+        rows.close()
+        if first is not None:
+            firsts.append((first[0], path))
+    firsts.sort(key=lambda first: first[0])
+    columns = Columns()
+    try:
+        for first, path in firsts:
+            for stamp, values in reader(path, midnight):
+                columns.add(stamp, values)
+        if not (columns.rows or columns.times):
+            return False
+        columns.save(stem)
+        return True
+    finally:
+        columns.close()
+
+
+def ConvertDay(daydir, only=None):
+    '''
+    Convert the station-days in a YYMMDD folder that have changed. With
+    only, a set of file names, just the station-days holding one of those
+    files are looked at. Returns the number of station-days converted.
+    '''
+    midnight = Midnight(daydir)
+    if midnight is None:
+        return 0
+    converted = 0
+    for (observer, suffix), files in StationDays(daydir).items():
+        if only is not None and not only.intersection(files):
+            continue
+        stem = os.path.join(daydir, 'UT{}_VLF_{}_{}'.format(
+            time.strftime('%Y%m%d', time.gmtime(midnight)), observer, suffix))
+        paths = [os.path.join(daydir, file) for file in files]
+        if not Stale(stem, paths):
+            continue
+        done = False
+        while True:
+            before = Modified(paths)
+            done = ConvertStation(stem, paths, Readers[suffix], midnight) or done
+            # another job sorting the same observer may have added a file
+            # since the folder was listed, older than the .npy files now
+            paths = [os.path.join(daydir, file) for file in StationDays(daydir).get((observer, suffix), [])]
+            if Modified(paths) == before:
+                break
+        converted += done
+    return converted
+
+
+def ConvertCopied(copied):
+    '''
+    Convert the station-days that files have just been copied into.
+    copied is a list of (NewDir, NewFileName). Returns the number converted.
+    '''
+    days = defaultdict(set)
+    for NewDir, NewFileName in copied:
+        days[NewDir].add(NewFileName)
+    return sum(ConvertDay(daydir, names) for daydir, names in sorted(days.items()))
+
+
+def DayFolders(outdir):
+    '''Every YYYY/YYMM/YYMMDD folder under outdir, in date order.'''
+    level = [outdir]
+    for pattern in (r'\d{4}$', r'\d{4}$', r'\d{6}$'):
+        below = []
+        for path in level:
+            try:
+                names = sorted(os.listdir(path))
+            except OSError:
+                continue
+            below.extend(os.path.join(path, name) for name in names
+                         if re.match(pattern, name) and os.path.isdir(os.path.join(path, name)))
+        level = below
+    return level
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert sorted SID data files to .npy columns for each station and day')
+    parser.add_argument('-o', '--o', dest='outdir', default='./',
+                        help='Sorted files directory default is ./')
+    args = parser.parse_args(argv)
+    StartTime = time.time()
+    print('Sidconvert started {}'.format(datetime.datetime.now().time()))
+    days = DayFolders(args.outdir)
+    converted = sum(ConvertDay(daydir) for daydir in days)
+    print('{} station-days converted in {} day folders in {:.3f} seconds'.format(
+        converted, len(days), time.time() - StartTime))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
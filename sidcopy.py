@@ -0,0 +1,473 @@
+'''
+###  sidcopy.py
+###  Copy engine shared by sidsort.py and vsidsort.py
+###
+###**************************
+###  The sort scripts walk the input tree and work out the new name for each
+###  file as before, but instead of copying there and then they hand the copy
+###  to a CopyQueue. The queue runs up to 'workers' copies at once and reports
+###  them back in the same order they were found, so the output and the
+###  counts are the same however many workers are used.
+###
+###  How a file gets to its new home is set by the mode:
+###    copy     - copy the contents, in the kernel where the OS allows it
+###    hardlink - link the new name to the same data (same filesystem only)
+###    reflink  - copy-on-write clone (btrfs, XFS, APFS style filesystems)
+###    move     - move the file out of the input folder
+###  hardlink and reflink fall back to a copy when the filesystem says no.
+###
+###  Files inside .zip archives are streamed straight from the archive to
+###  their new name with ExtractMember, nothing is unpacked to disk first.
+###
+###  Every file is written to a hidden .[NewFileName].[pid]-[thread].part
+###  file beside its new name and renamed once it is complete, so a run that
+###  is stopped part way never leaves a half written file under the new name
+###  for the next run to take as already sorted, and runs writing the same
+###  name at once never get in each other's way. Atomic does this for the
+###  .npy, quicklook and bundle files as well. A .part file left by a
+###  stopped run is removed the next time a file is copied into its folder,
+###  once it is an hour old.
+###
+###  DirCache makes the YYYY/YYMM/YYMMDD output directories.  It remembers the
+###  ones it has made or seen, so each is checked at most once per run
+###  rather than once for every file that goes in it.
+###
+###**************************
+'''
+import os
+import glob
+import shutil
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+# how many copies may be waiting per worker before the walk is held back
+BACKLOG_PER_WORKER = 64
+
+# what CopyQueue.add did with a file
+COPIED = 'copied'
+VERSIONED = 'versioned'
+EXISTS = 'exists'
+IDENTICAL = 'identical'
+DUPLICATE = 'duplicate'
+CONFLICT = 'conflict'
+Conflicts = ('flag', 'version')
+
+Modes = ('copy', 'hardlink', 'reflink', 'move')
+
+# ioctl number for a reflink clone on Linux, from <linux/fs.h>
+FICLONE = 0x40049409
+# largest chunk handed to copy_file_range in one call
+CHUNK = 1 << 30
+# a temporary file untouched for this long was left by a run that was stopped
+STALE_SECONDS = 3600
+
+
+def CopyContents(source, destination, mode='xb'):
+    '''
+    Copy the bytes of source to destination without the permission bits.
+    Uses copy_file_range where there is one, so the data need not pass
+    through Python at all, and shutil.copyfile (sendfile on Linux) otherwise.
+    destination must not exist yet unless mode is 'wb'.
+    '''
+    if hasattr(os, 'copy_file_range'):
+        with open(source, 'rb') as fsrc, open(destination, mode) as fdst:
+            try:
+                size = os.fstat(fsrc.fileno()).st_size
+                copied = 0
+                while True:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), CHUNK)
+                    if not n:
+                        break
+                    copied += n
+                # some filesystems, network and FUSE ones among them, give 0
+                # before the end; anything short is copied again below
+                if copied >= size:
+                    return
+            except OSError:
+                # not supported between these two files, start again below
+                pass
+    else:
+        # take the name first, so what is there is never written through
+        open(destination, mode).close()
+    shutil.copyfile(source, destination)
+
+
+def HardLink(source, destination):
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        raise
+    except OSError:
+        # different filesystems, or links not supported
+        CopyContents(source, destination)
+
+
+def RefLink(source, destination):
+    try:
+        import fcntl
+    except ImportError:
+        # not Linux
+        CopyContents(source, destination)
+        return
+    with open(source, 'rb') as fsrc, open(destination, 'xb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            # the filesystem cannot clone
+            pass
+    CopyContents(source, destination, 'wb')
+
+
+def MoveFile(source, destination):
+    # a rename on the same filesystem, a copy and delete otherwise
+    shutil.move(source, destination)
+
+
+def PartName(destination):
+    '''
+    The temporary name a file is written to before it is renamed to
+    destination. It holds the process and thread ids, so two writers of the
+    same destination, such as two sidbatch jobs, never share one.
+    '''
+    folder, name = os.path.split(destination)
+    return os.path.join(folder, '.{}.{}-{}.part'.format(name, os.getpid(), threading.get_ident()))
+
+
+def Atomic(write, destination):
+    '''
+    Call write with a temporary name next to destination, then rename what
+    it wrote to destination, so a reader never sees half a file. If write
+    fails the temporary file is removed. Everything written into the
+    output tree goes through here.
+    '''
+    temp = PartName(destination)
+    try:
+        try:
+            write(temp)
+        except FileExistsError:
+            # left by a stopped process with the same id
+            os.unlink(temp)
+            write(temp)
+        os.replace(temp, destination)
+    except BaseException:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        raise
+
+
+def ClearParts(folder, age=STALE_SECONDS):
+    '''
+    Remove the temporary files in folder that have not changed for age
+    seconds, left there by runs that were stopped part way. Files still
+    being written are younger than that. Returns the number removed.
+    '''
+    removed = 0
+    now = time.time()
+    for path in glob.glob(os.path.join(glob.escape(folder), '.*.part')):
+        try:
+            info = os.lstat(path)
+            # a link or rename sets ctime, a write mtime
+            if now - max(info.st_mtime, info.st_ctime) > age:
+                os.unlink(path)
+                removed += 1
+        except OSError:
+            # gone already, renamed by its writer or removed by another run
+            pass
+    return removed
+
+
+def ExtractMember(Archive, info, destination):
+    '''
+    Stream one member of an open zipfile.ZipFile to destination.
+    Several members of the same archive can be extracted at once.
+    '''
+    with Archive.open(info) as fsrc, open(destination, 'xb') as fdst:
+        shutil.copyfileobj(fsrc, fdst, 1 << 20)
+
+
+Transfers = {
+    'copy': CopyContents,
+    'hardlink': HardLink,
+    'reflink': RefLink,
+    'move': MoveFile,
+    }
+
+
+class DirCache:
+    '''
+    Create output directories once each. Safe to share between threads.
+    If outdir is given, the YYYY/YYMM/YYMMDD directories already under it
+    are read first with one listing per year and month. known is a set of
+    directories already known to exist, such as another DirCache's known.
+    '''
+
+    def __init__(self, outdir=None, known=()):
+        self.known = set(known)
+        self.lock = threading.Lock()
+        if outdir is not None:
+            self.scan(outdir)
+
+    def scan(self, outdir, depth=3):
+        '''
+        Remember the directories up to depth levels below outdir, named the
+        same way as the NewDir paths made by sidplan.
+        '''
+        level = [outdir]
+        for _ in range(depth):
+            below = []
+            for path in level:
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                below.append('{}/{}'.format(path, entry.name))
+                except OSError:
+                    continue
+            self.known.update(below)
+            level = below
+
+    def make(self, path):
+        '''Make sure the directory path exists.'''
+        if path in self.known:
+            return
+        with self.lock:
+            if path in self.known:
+                return
+            os.makedirs(path, exist_ok=True)
+            self.known.add(path)
+
+
+class CopyQueue:
+    '''
+    Run file copies on a pool of worker threads.
+
+    report(file, NewFileName, NewDir) is called from the thread that owns the
+    queue (never from a worker) once each copy has finished, in the order the
+    copies were added. If a sidindex.SortIndex is given every source that
+    ends up in the output tree is recorded in it.
+    mode is one of Modes and says how the file gets to its new name.
+    If a sidmetrics.Metrics is given the copy time, the bytes copied and the
+    time spent checking for existing files are added to it. If a
+    sidjournal.Journal is given every file is recorded in it with what was
+    done, copies once they have finished.
+
+    With verify=True (which needs the index, for its hash cache) a file is
+    compared by content, not just by name:
+      - if the destination holds the same data it is IDENTICAL and skipped
+      - if it holds different data it is a CONFLICT, and is skipped when
+        on_conflict is 'flag', or copied to the next free _v2, _v3... name
+        when on_conflict is 'version'
+      - if the same data is already sorted under another name it is a
+        DUPLICATE and skipped; twin is then set to that file's path
+    A file queued earlier in the same run counts as already there, even if
+    it has not been written yet. Files inside zip archives are only checked by name.
+
+    A file the index shows was sorted to destination before, and which has
+    changed since, is copied again over its old copy rather than found to
+    exist, with or without verify.
+    '''
+
+    def __init__(self, workers=1, report=None, index=None, mode='copy', metrics=None,
+                 verify=False, on_conflict='flag', journal=None):
+        self.workers = max(1, int(workers))
+        self.report = report
+        self.index = index
+        self.metrics = metrics
+        self.journal = journal
+        self.transfer = Transfers[mode]
+        self.verify = verify and index is not None
+        self.on_conflict = on_conflict
+        self.twin = None
+        # destinations already handed out in this run, with the hash of
+        # the file going there when it was checked with verify
+        self.planned = {}
+        # (hash, size): destination of the files checked with verify and
+        # queued this run, which may not be written yet
+        self.queued = {}
+        # output directories already cleared of old temporary files
+        self.cleared = set()
+        # (future, source, file, NewFileName, NewDir, digest, label, outcome) in the order they were added
+        self.pending = deque()
+        self.pool = None
+        if self.workers > 1:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def add(self, source, NewDir, NewFileName, file, extract=None):
+        '''
+        Queue source to be copied to NewDir/NewFileName and return what was
+        done: COPIED or VERSIONED if it will be copied, EXISTS if the
+        destination already exists or has already been queued by an earlier
+        file in this run, or IDENTICAL, DUPLICATE or CONFLICT with verify.
+        If extract is given it is called with the destination path in place
+        of the normal copy, and source is only used as a label; this is how
+        members of zip archives are copied. Those are not recorded in the index.
+        '''
+        destination = '{}/{}'.format(NewDir, NewFileName)
+        # what the journal knows the file by, zip members included
+        label = source
+        # with verify an earlier file going to the same name is compared by _check
+        if destination in self.planned and not (self.verify and extract is None):
+            self._record(label, destination, EXISTS)
+            return EXISTS
+        if self.metrics is None:
+            exists = os.path.isfile(destination)
+        else:
+            with self.metrics.timer('stat'):
+                exists = os.path.isfile(destination)
+
+        outcome = COPIED
+        digest = None
+        if exists and extract is None and self._stale(source, destination):
+            # an earlier copy of this very file, which has changed since: copied again
+            pass
+        elif self.verify and extract is None:
+            outcome, NewFileName, digest = self._check(source, NewDir, NewFileName, exists)
+            destination = '{}/{}'.format(NewDir, NewFileName)
+            if outcome not in (COPIED, VERSIONED):
+                if outcome == IDENTICAL:
+                    self.index.record(source, destination)
+                # a duplicate is already sorted as its twin
+                self._record(label, self.twin if outcome == DUPLICATE else destination, outcome)
+                return outcome
+            self.queued[digest, os.path.getsize(source)] = destination
+        elif exists:
+            if self.index is not None and extract is None:
+                self.index.record(source, destination)
+            self._record(label, destination, EXISTS)
+            return EXISTS
+        self.planned[destination] = digest
+        if NewDir not in self.cleared:
+            self.cleared.add(NewDir)
+            ClearParts(NewDir)
+
+        if extract is None:
+            job = partial(Atomic, partial(self.transfer, source), destination)
+        else:
+            job = partial(Atomic, extract, destination)
+            # keep zip members out of the index
+            source = None
+        if self.metrics is not None:
+            job = partial(self._measure, job, destination)
+
+        if self.pool is None:
+            job()
+            self._report(source, file, NewFileName, NewDir, digest, label, outcome)
+            return outcome
+
+        future = self.pool.submit(job)
+        self.pending.append((future, source, file, NewFileName, NewDir, digest, label, outcome))
+        # report whatever has finished and keep the backlog bounded
+        self.drain(block=len(self.pending) > self.workers * BACKLOG_PER_WORKER)
+        return outcome
+
+    def _stale(self, source, destination):
+        '''
+        True if destination is where the index shows source was sorted to
+        before, and source has changed since so the copy is out of date,
+        such as a file that was still being uploaded when it was copied.
+        '''
+        if self.index is None:
+            return False
+        row = self.index.sorted_as(source)
+        if row is None or row[2] != destination:
+            return False
+        st = os.stat(source)
+        if (st.st_size, st.st_mtime_ns) == tuple(row[:2]):
+            return False
+        if st.st_size != os.path.getsize(destination):
+            return True
+        return self.index.hash(source) != self.index.hash(destination, sorted=True)
+
+    def _check(self, source, NewDir, NewFileName, exists):
+        '''
+        Compare source with what is already sorted.
+        Returns (outcome, NewFileName, hash of source).
+        '''
+        timer = self.metrics.timer('verify') if self.metrics is not None else nullcontext()
+        with timer:
+            size = os.path.getsize(source)
+            digest = self.index.hash(source)
+            if not exists and '{}/{}'.format(NewDir, NewFileName) not in self.planned:
+                # the same data queued earlier this run, or sorted on an earlier one
+                self.twin = self.queued.get((digest, size)) or self.index.twin(digest, size)
+                if self.twin is not None:
+                    return DUPLICATE, NewFileName, digest
+                return COPIED, NewFileName, digest
+            stem, dot, suffix = NewFileName.rpartition('.')
+            version = 1
+            while True:
+                destination = '{}/{}'.format(NewDir, NewFileName)
+                if destination in self.planned:
+                    # an earlier file in this run is going there, which may not be written yet
+                    if self.planned[destination] == digest:
+                        return IDENTICAL, NewFileName, digest
+                elif not os.path.isfile(destination):
+                    return VERSIONED, NewFileName, digest
+                # cheap size check first, only hash when the sizes match
+                elif os.path.getsize(destination) == size and self.index.hash(destination, sorted=True) == digest:
+                    return IDENTICAL, NewFileName, digest
+                if self.on_conflict != 'version':
+                    return CONFLICT, NewFileName, digest
+                version += 1
+                NewFileName = '{}_v{}{}{}'.format(stem, version, dot, suffix)
+
+    def drain(self, block=False):
+        '''
+        Report finished copies in order. With block=True wait for at least
+        the oldest outstanding copy.
+        '''
+        while self.pending:
+            future, source, file, NewFileName, NewDir, digest, label, outcome = self.pending[0]
+            if not block and not future.done():
+                break
+            # re-raises any error from the copy, just as copying inline would
+            future.result()
+            self.pending.popleft()
+            self._report(source, file, NewFileName, NewDir, digest, label, outcome)
+            block = False
+
+    def wait(self):
+        '''Wait for, and report, every copy queued so far.'''
+        while self.pending:
+            self.drain(block=True)
+
+    def finish(self):
+        '''Wait for every queued copy and shut the workers down.'''
+        try:
+            self.wait()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown(wait=True)
+
+    def _measure(self, job, destination):
+        # runs on a worker thread
+        start = time.perf_counter()
+        job()
+        self.metrics.add_time('copy', time.perf_counter() - start)
+        self.metrics.add_bytes(os.stat(destination).st_size)
+
+    def _record(self, label, destination, outcome, size=None):
+        if self.journal is not None:
+            self.journal.record(label, destination, outcome, size)
+
+    def _report(self, source, file, NewFileName, NewDir, digest=None, label=None, outcome=COPIED):
+        if self.index is not None and source is not None:
+            self.index.record(source, '{}/{}'.format(NewDir, NewFileName))
+            if digest is not None:
+                self.index.remember('{}/{}'.format(NewDir, NewFileName), digest)
+        if self.journal is not None:
+            destination = '{}/{}'.format(NewDir, NewFileName)
+            try:
+                size = os.path.getsize(destination)
+            except OSError:
+                size = None
+            self.journal.record(label, destination, outcome, size)
+        if self.report is not None:
+            self.report(file, NewFileName, NewDir)
@@ -0,0 +1,282 @@
+'''
+###  sidindex.py
+###  Persistent record of the input files that have already been sorted
+###
+###**************************
+###  The index is a small SQLite database kept in the root of the output
+###  folder. Every input file that ends up in the sorted tree is stored with
+###  its size, modification time and where it went, so the next run can
+###  pass over it once its new name is worked out (just a regular
+###  expression) and its sorted copy is seen to be there, without opening,
+###  copying or, with --verify, hashing it again. A file
+###  that is new, has changed size or mtime, now goes somewhere else (such
+###  as another observer or rule table) or whose sorted copy has gone is
+###  sorted as normal. A zip archive is recorded under the output folder,
+###  observer and rules, see sidplan.Classifier.
+###
+###  The same database caches content hashes for the --verify option, again
+###  keyed by path, size and mtime so a file is only hashed again once it
+###  changes. Hashes of sorted files are marked so that a file with the same
+###  data as one already sorted under another name can be found.
+###  xxhash is used if it is installed, BLAKE2 from hashlib if not.
+###
+###  sidupload.py keeps the sorted files it has sent to the portal here too,
+###  with their size and mtime and the address they went to, so a file is
+###  only sent again once it changes.
+###
+###  New records are held in memory and written COMMIT_EVERY at a time in
+###  one short transaction, so several processes (see sidbatch.py) can
+###  share one index without holding each other up.
+###
+###**************************
+'''
+import hashlib
+import os
+import re
+import sqlite3
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+IndexName = '.sidsort-index.sqlite'
+# each shard has an index of its own, as SQLite cannot be shared between machines
+ShardIndexName = '.sidsort-index-{}-of-{}.sqlite'
+# how many new records are held before they are written to disk
+COMMIT_EVERY = 1000
+# seconds to wait for another process that is writing to the index
+BUSY_TIMEOUT = 60
+# bytes read at a time when hashing
+HASH_CHUNK = 1 << 20
+# the _v2, _v3... of a file kept by --on-conflict version
+Versioned = re.compile(r'_v\d+(?=\.[^./]*$)')
+
+if xxhash is not None:
+    HashName = 'xxh3_128'
+    NewHash = xxhash.xxh3_128
+else:
+    HashName = 'blake2b'
+    NewHash = lambda: hashlib.blake2b(digest_size=16)
+
+
+def FileHash(path):
+    '''
+    Content hash of the file at path, as text starting with the hash's name
+    so hashes made with different functions never match.
+    '''
+    h = NewHash()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return '{}:{}'.format(HashName, h.hexdigest())
+
+
+class SortIndex:
+    '''
+    Index of sorted input files kept in outdir.
+    With rescan=True every file is treated as changed, but the index is
+    still brought up to date. name is the file name of the database, such
+    as ShardIndexName for a run with sidsort.py --shard. With readonly=True
+    an existing index is only read, as for sidsort.py --dry-run, and
+    nothing recorded is written.
+    '''
+
+    def __init__(self, outdir, rescan=False, name=IndexName, readonly=False):
+        self.outdir = outdir
+        self.path = os.path.join(outdir, name)
+        self.rescan = rescan
+        self.readonly = readonly
+        # size and mtime of the files checked this run, waiting for record()
+        self.seen = {}
+        # rows not yet written, for the files and hashes tables
+        self.new_files = []
+        self.new_hashes = {}
+        self.new_uploads = {}
+        if readonly:
+            # only needed here, and slow to import
+            from urllib.request import pathname2url
+            # with no run writing to it, and so no -wal file, it is opened as
+            # immutable, else SQLite leaves -wal and -shm files behind
+            mode = 'ro' if os.path.exists(self.path + '-wal') else 'ro&immutable=1'
+            self.db = sqlite3.connect('file:{}?mode={}'.format(pathname2url(os.path.abspath(self.path)), mode),
+                                      timeout=BUSY_TIMEOUT, uri=True)
+            return
+        self.db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS files (
+                               source TEXT PRIMARY KEY,
+                               size INTEGER NOT NULL,
+                               mtime INTEGER NOT NULL,
+                               destination TEXT NOT NULL)''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS hashes (
+                               path TEXT PRIMARY KEY,
+                               size INTEGER NOT NULL,
+                               mtime INTEGER NOT NULL,
+                               hash TEXT NOT NULL,
+                               sorted INTEGER NOT NULL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS hashes_by_hash ON hashes (hash, size)')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS uploads (
+                               path TEXT NOT NULL,
+                               url TEXT NOT NULL,
+                               size INTEGER NOT NULL,
+                               mtime INTEGER NOT NULL,
+                               PRIMARY KEY (path, url))''')
+
+    def unchanged(self, source, st=None, destination=None):
+        '''
+        True if source has already been sorted and has not changed since.
+        st is the result of stat for source if the caller already has it,
+        such as from os.DirEntry.stat(). If destination is given source must
+        also have been sorted there, or to a _v2, _v3... of it, so a file
+        sorted for another observer or with other rules is sorted again.
+        '''
+        source = os.path.abspath(source)
+        if st is None:
+            try:
+                st = os.stat(source)
+            except OSError:
+                return False
+        key = (st.st_size, st.st_mtime_ns)
+        if not self.rescan:
+            row = self.db.execute('SELECT size, mtime, destination FROM files WHERE source = ?',
+                                  (source,)).fetchone()
+            if row is not None and row[:2] == key and (
+                    destination is None or Versioned.sub('', row[2]) == destination):
+                return True
+        self.seen[source] = key
+        return False
+
+    def sorted_as(self, source):
+        '''
+        (size, mtime, destination) source was last recorded with, records
+        not yet written included, or None if it has never been sorted.
+        '''
+        source = os.path.abspath(source)
+        for row in reversed(self.new_files):
+            if row[0] == source:
+                return row[1:]
+        return self.db.execute('SELECT size, mtime, destination FROM files WHERE source = ?',
+                               (source,)).fetchone()
+
+    def record(self, source, destination):
+        '''
+        Remember that source has been sorted into destination.
+        '''
+        source = os.path.abspath(source)
+        key = self.seen.pop(source, None)
+        if key is None:
+            try:
+                st = os.stat(source)
+            except OSError:
+                return
+            key = (st.st_size, st.st_mtime_ns)
+        self.new_files.append((source, key[0], key[1], destination))
+        if len(self.new_files) >= COMMIT_EVERY:
+            self.commit()
+
+    def hash(self, path, sorted=False):
+        '''
+        Content hash of the file at path, from the cache if the file has not
+        changed since it was last hashed. sorted=True marks a file in the
+        output tree, which twin() can then find.
+        '''
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self.new_hashes.get(path)
+        if row is not None:
+            row = row[1:]
+        else:
+            row = self.db.execute('SELECT size, mtime, hash, sorted FROM hashes WHERE path = ?',
+                                  (path,)).fetchone()
+        if row is not None and row[:2] == (st.st_size, st.st_mtime_ns):
+            if sorted and not row[3]:
+                self._store_hash(path, st, row[2], sorted)
+            return row[2]
+        digest = FileHash(path)
+        self._store_hash(path, st, digest, sorted)
+        return digest
+
+    def remember(self, path, digest):
+        '''
+        Store the hash of a file just written to the output tree, so it does
+        not have to be read back.
+        '''
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        self._store_hash(path, st, digest, True)
+
+    def twin(self, digest, size):
+        '''
+        The path of a sorted file holding exactly this data, or None.
+        Entries for files that have since changed or gone are dropped.
+        '''
+        # files sorted earlier in this run may not be written yet
+        rows = [(row[0], row[2]) for row in self.new_hashes.values()
+                if row[3] == digest and row[1] == size and row[4]]
+        rows += self.db.execute('SELECT path, mtime FROM hashes WHERE hash = ? AND size = ? AND sorted = 1',
+                                (digest, size)).fetchall()
+        for path, mtime in rows:
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is not None and (st.st_size, st.st_mtime_ns) == (size, mtime):
+                return path
+            self.new_hashes.pop(path, None)
+            with self.db:
+                self.db.execute('DELETE FROM hashes WHERE path = ?', (path,))
+        return None
+
+    def uploaded(self, path, url, st=None):
+        '''
+        True if the file at path has been uploaded to url and has not
+        changed since.
+        '''
+        path = os.path.abspath(path)
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+        row = self.new_uploads.get((path, url))
+        if row is not None:
+            row = row[2:]
+        else:
+            row = self.db.execute('SELECT size, mtime FROM uploads WHERE path = ? AND url = ?',
+                                  (path, url)).fetchone()
+        return row == (st.st_size, st.st_mtime_ns)
+
+    def record_upload(self, path, url, st):
+        '''Remember that the file at path, as it was when st was taken, has been uploaded to url.'''
+        path = os.path.abspath(path)
+        self.new_uploads[path, url] = (path, url, st.st_size, st.st_mtime_ns)
+        if len(self.new_uploads) >= COMMIT_EVERY:
+            self.commit()
+
+    def _store_hash(self, path, st, digest, sorted):
+        self.new_hashes[path] = (path, st.st_size, st.st_mtime_ns, digest, int(sorted))
+        if len(self.new_hashes) >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        '''Write everything recorded so far to disk.'''
+        if self.readonly or (not self.new_files and not self.new_hashes and not self.new_uploads):
+            return
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', self.new_files)
+            self.db.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)',
+                                self.new_hashes.values())
+            self.db.executemany('INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)',
+                                self.new_uploads.values())
+        self.new_files = []
+        self.new_hashes = {}
+        self.new_uploads = {}
+
+    def close(self):
+        self.commit()
+        self.db.close()
@@ -0,0 +1,235 @@
+'''
+###  sidjournal.py
+###  Journal of a sort run, so an interrupted run can carry on, and the
+###  report of several runs put together
+###
+###**************************
+###  Usage: py sidjournal.py -o=./output_path (report on every journal there)
+###  py sidjournal.py node1.jsonl node2.jsonl --json=report.json
+###  py sidjournal.py -h (command line help)
+###
+###  sidsort.py writes a line to the journal as each file is finished with:
+###  copied, or found to exist already, to be a duplicate and so on. Each
+###  line is written to the file straight away, so after a crash or Ctrl+C
+###  the journal shows exactly what was done. The journal is kept in the
+###  output folder:
+###    .sidsort-journal.jsonl            - a run of the whole input
+###    .sidsort-journal-2-of-4.jsonl     - a run with --shard 2/4
+###  and is made of JSON lines:
+###    {"run": {...}}                    - input, output, observer, rules,
+###                                        shard, host, start
+###    {"source": ..., "destination": ..., "outcome": ..., "bytes": ...}
+###    {"resumed": time}                 - a run carried on from here
+###    {"finished": time, ...}           - the run ended, with its totals
+###
+###  When a run of the same input, output, observer, rules and shard starts
+###  and the journal has no finished line, the files it lists are passed
+###  over and the run carries on after them. Otherwise the journal is
+###  started again.
+###
+###  Run on its own this script adds up the journals of several runs, such
+###  as one per shard on different machines, into one report, and says
+###  which shards are missing or did not finish.
+###
+###**************************
+'''
+import os, datetime, time
+import argparse
+import glob
+import json
+import platform
+import sys
+from collections import Counter
+
+JournalName = '.sidsort-journal.jsonl'
+ShardJournalName = '.sidsort-journal-{}-of-{}.jsonl'
+
+
+def JournalPath(outdir, shard=None):
+    '''The journal in outdir for a run, shard being (i, N) or None.'''
+    if shard is None:
+        return os.path.join(outdir, JournalName)
+    return os.path.join(outdir, ShardJournalName.format(*shard))
+
+
+def ReadJournal(path):
+    '''
+    Read a journal. Returns a dict of 'run' (the first line), 'entries' (a
+    line for each file), 'resumed' (times it was carried on) and 'finished'
+    (the last line, or None if the run did not finish). A line cut short
+    by a crash is passed over.
+    '''
+    journal = {'path': path, 'run': None, 'entries': [], 'resumed': [], 'finished': None}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(record, dict):
+                continue
+            if 'run' in record:
+                journal['run'] = record['run']
+            elif 'source' in record:
+                journal['entries'].append(record)
+            elif 'finished' in record:
+                journal['finished'] = record
+            elif 'resumed' in record:
+                journal['resumed'].append(record['resumed'])
+                journal['finished'] = None
+    return journal
+
+
+def SameRun(run, other):
+    '''True if two run lines are for the same input, output, observer, rules and shard.'''
+    keys = ('input', 'output', 'observer', 'rules', 'shard', 'shard_by')
+    return other is not None and all(run.get(key) == other.get(key) for key in keys)
+
+
+class Journal:
+    '''
+    The journal of one run at path. run is a dict saying what is being
+    sorted. If the journal there is of the same run and did not finish, it
+    is carried on: done holds the sources it lists, which the sort can pass
+    over. Not safe to share between threads.
+    '''
+
+    def __init__(self, path, run):
+        self.path = path
+        self.done = set()
+        self.resumed = False
+        # as it will read back, tuples as lists
+        run = json.loads(json.dumps(run))
+        old = ReadJournal(path) if os.path.isfile(path) else None
+        if old is not None and old['finished'] is None and SameRun(run, old['run']):
+            self.resumed = True
+            self.done = {entry['source'] for entry in old['entries']}
+            # line buffered, so each line is on disk as soon as it is written
+            self.f = open(path, mode='at', encoding='utf-8', buffering=1)
+            if self.f.tell() and not self._ends_in_newline():
+                # the last line was cut short
+                self.f.write('\n')
+            self._write({'resumed': time.time()})
+        else:
+            self.f = open(path, mode='wt', encoding='utf-8', buffering=1)
+            run = dict(run, host=platform.node(), started=time.time())
+            self._write({'run': run})
+
+    def _ends_in_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _write(self, record):
+        self.f.write(json.dumps(record) + '\n')
+
+    def record(self, source, destination, outcome, size=None):
+        '''Note that source is finished with: outcome is one of the sidcopy outcomes.'''
+        entry = {'source': source, 'destination': destination, 'outcome': outcome}
+        if size is not None:
+            entry['bytes'] = size
+        self._write(entry)
+
+    def finish(self, **totals):
+        '''Mark the run as finished, with its totals, and close the journal.'''
+        if self.f.closed:
+            return
+        self._write(dict({'finished': time.time()}, **totals))
+        self.f.close()
+
+    def close(self):
+        '''Close the journal without finishing it, so the next run carries on from here.'''
+        if not self.f.closed:
+            self.f.close()
+
+
+def Merge(journals):
+    '''
+    Add up journals, as read by ReadJournal. Each source is counted once,
+    by its last line, so files done again after a crash are not counted twice.
+    Returns a dict for the report.
+    '''
+    outcomes = Counter()
+    size = 0
+    runs = []
+    shards = set()
+    counts = set()
+    for journal in journals:
+        last = {}
+        for entry in journal['entries']:
+            last[entry['source']] = entry
+        mine = Counter(entry['outcome'] for entry in last.values())
+        mybytes = sum(entry.get('bytes', 0) for entry in last.values())
+        outcomes.update(mine)
+        size += mybytes
+        run = journal['run'] or {}
+        if run.get('shard'):
+            shards.add(run['shard'][0])
+            counts.add(run['shard'][1])
+        runs.append({
+            'path': journal['path'],
+            'host': run.get('host'),
+            'input': run.get('input'),
+            'shard': run.get('shard'),
+            'finished': journal['finished'] is not None,
+            'resumed': len(journal['resumed']),
+            'outcomes': dict(mine),
+            'bytes': mybytes,
+            })
+    missing = []
+    if len(counts) == 1:
+        missing = sorted(set(range(1, counts.pop() + 1)) - shards)
+    return {
+        'runs': runs,
+        'outcomes': dict(outcomes),
+        'bytes': size,
+        'unfinished': [run['path'] for run in runs if not run['finished']],
+        'missing_shards': missing,
+        }
+
+
+def Report(merged):
+    '''The lines of text for a merged report.'''
+    lines = []
+    for run in merged['runs']:
+        shard = '{}/{}'.format(*run['shard']) if run['shard'] else 'all'
+        lines.append('{} shard {} on {}: {}{}'.format(
+            os.path.basename(run['path']), shard, run['host'],
+            ', '.join('{} {}'.format(outcome, n) for outcome, n in sorted(run['outcomes'].items())) or 'nothing done',
+            '' if run['finished'] else ' - did not finish'))
+    lines.append('Total: ' + (', '.join('{} {}'.format(outcome, n)
+                                        for outcome, n in sorted(merged['outcomes'].items())) or 'nothing done'))
+    lines.append('Bytes copied = {}'.format(merged['bytes']))
+    if merged['missing_shards']:
+        lines.append('No journal for shards {}'.format(', '.join(str(i) for i in merged['missing_shards'])))
+    if merged['unfinished']:
+        lines.append('{} runs did not finish, run them again to carry on'.format(len(merged['unfinished'])))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Put the journals of several sort runs together into one report')
+    parser.add_argument('journals', nargs='*',
+                        help='Journal files, default is every journal in the output folder')
+    parser.add_argument('-o', '--o', dest='outdir', default='./',
+                        help='Output files directory to find the journals in, default is ./')
+    parser.add_argument('--json', dest='json',
+                        help='Save the report to this JSON file')
+    args = parser.parse_args(argv)
+    paths = args.journals or sorted(glob.glob(os.path.join(glob.escape(args.outdir), '.sidsort-journal*.jsonl')))
+    if not paths:
+        print('No journals found in {}'.format(args.outdir))
+        return 1
+    print('Sidjournal started {}'.format(datetime.datetime.now().time()))
+    merged = Merge(ReadJournal(path) for path in paths)
+    for line in Report(merged):
+        print(line)
+    if args.json:
+        with open(args.json, mode='wt', encoding='utf-8') as f:
+            json.dump(merged, f, indent=2)
+        print('Report saved to {}'.format(args.json))
+    return 1 if merged['unfinished'] or merged['missing_shards'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+'''
+###  sidmetrics.py
+###  Counters and timers for a sort run
+###
+###**************************
+###  A Metrics object is handed to sidplan.MakePlan, sidplan.Execute and
+###  sidcopy.CopyQueue, which add the time spent in each phase of the sort:
+###    walk     - listing the input folders
+###    stat     - checking the index and the output for existing files
+###    classify - working out new names, including reading zip directories
+###    mkdir    - making output directories
+###    verify   - hashing and comparing contents, with --verify
+###    copy     - copying, summed over all the copy workers
+###    convert  - converting new data to .npy files, with --convert, and
+###               summarising it with --quicklook
+###    bundle   - writing each day's files into one archive, with --bundle
+###    upload   - sending files to the portal, summed over all the
+###               connections, by sidupload.py
+###  along with how many files of each suffix were copied, already existed,
+###  were skipped or passed over as unchanged, and the bytes copied.
+###
+###**************************
+'''
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+
+Phases = ('walk', 'stat', 'classify', 'mkdir', 'verify', 'copy', 'convert', 'bundle', 'upload')
+Outcomes = ('copied', 'versioned', 'exists', 'identical', 'duplicate', 'conflict',
+            'skipped', 'unchanged', 'resumed', 'uploaded', 'failed')
+
+
+def Suffix(file):
+    '''The suffix metrics are counted under, e.g. 'dat' for 20190101.dat'''
+    _, dot, suffix = file.rpartition('.')
+    return suffix.lower() if dot else ''
+
+
+def Percentiles(values, points=(50, 90, 99)):
+    '''{'p50': ..., 'p90': ..., 'p99': ..., 'max': ...} of values, by the nearest rank.'''
+    values = sorted(values)
+    if not values:
+        return {}
+    result = {'p{}'.format(point): values[max(0, -(-len(values) * point // 100) - 1)] for point in points}
+    result['max'] = values[-1]
+    return result
+
+
+class Timer:
+    '''Adds the time spent inside a with block to a phase.'''
+
+    __slots__ = ('metrics', 'phase', 'start')
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add_time(self.phase, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    '''
+    Phase timings and counts for one run. Safe to update from several threads.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.finished = None
+        self.seconds = Counter()
+        self.counts = Counter()
+        self.suffixes = defaultdict(Counter)
+
+    def timer(self, phase):
+        return Timer(self, phase)
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self.seconds[phase] += seconds
+
+    def count(self, outcome, file=None, n=1):
+        '''Count n files with this outcome, under the suffix of file if given.'''
+        with self.lock:
+            self.counts[outcome] += n
+            if file is not None:
+                self.suffixes[Suffix(file)][outcome] += n
+
+    def add_bytes(self, n):
+        with self.lock:
+            self.counts['bytes'] += n
+
+    def merge(self, data):
+        '''Add in the times and counts of another run, given as its as_dict().'''
+        with self.lock:
+            self.seconds.update(data['phases'])
+            self.counts.update(data['counts'])
+            for suffix, counts in data['suffixes'].items():
+                self.suffixes[suffix].update(counts)
+
+    def finish(self):
+        self.finished = time.time()
+
+    def as_dict(self):
+        finished = self.finished if self.finished is not None else time.time()
+        with self.lock:
+            return {
+                'started': self.started,
+                'finished': finished,
+                'seconds': finished - self.started,
+                'phases': {phase: self.seconds.get(phase, 0.0) for phase in Phases},
+                'counts': dict(self.counts),
+                'suffixes': {suffix: dict(counts) for suffix, counts in sorted(self.suffixes.items())},
+                }
+
+    def summary(self):
+        '''A few lines of text showing where the time went.'''
+        data = self.as_dict()
+        lines = ['Time in ' + ', '.join('{} {:.3f}s'.format(phase, seconds)
+                                        for phase, seconds in data['phases'].items())]
+        lines.append('Bytes copied = {}'.format(data['counts'].get('bytes', 0)))
+        for suffix, counts in data['suffixes'].items():
+            lines.append('.{:<4} '.format(suffix) + ', '.join('{} {}'.format(outcome, counts[outcome])
+                                                              for outcome in Outcomes if outcome in counts))
+        return lines
+
+    def save(self, path, **extra):
+        '''Write the metrics, and anything in extra, to path as JSON.'''
+        data = self.as_dict()
+        data.update(extra)
+        with open(path, mode='wt', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
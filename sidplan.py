@@ -0,0 +1,346 @@
+'''
+###  sidplan.py
+###  Filename rules and the plan/execute steps shared by sidsort.py and vsidsort.py
+###
+###**************************
+###  Sorting happens in two steps:
+###    MakePlan - walk the input folder and work out the new directory and
+###               name of every file from the rule table, without touching
+###               the output folder.  The result is a Plan.  PlanFiles
+###               does the same for a list of files instead of a folder.
+###    Execute  - create the directories, each only once, and hand each file
+###               of the Plan to a sidcopy.CopyQueue.
+###  A Plan can also just be listed (a dry run) or given to another copier.
+###  ShardPlan keeps only the part of a Plan that one of several machines
+###  is to sort, split by where the files go so no two write the same file.
+###
+###  Each rule matches one file type with a regular expression.  The named
+###  groups it captures (Y = four digit year, y = two digit year, M = month,
+###  D = day and so on) fill in the NewDir and NewFileName templates, along
+###  with {name}, the observer's name.
+###
+###**************************
+'''
+import os
+import re
+import zipfile
+import zlib
+from collections import namedtuple
+from functools import partial
+import sidcopy
+import sidmetrics
+import sidwalk
+
+Rule = namedtuple('Rule', 'suffix pattern NewDir NewFileName')
+# source is the file, or the zip archive it is in; member is the name inside
+# the archive, or None for an ordinary file
+PlanItem = namedtuple('PlanItem', 'source member file NewDir NewFileName')
+
+
+def MakeRule(suffix, pattern, NewDir, NewFileName):
+    return Rule(suffix, re.compile(pattern), NewDir, NewFileName)
+
+
+# The naming convention UTYYYYMMDD[0HHSS]_VLF_[Name].[Suffix] used by vsidsort.py
+LongYearRules = (
+    # 20190101.dat
+    MakeRule('dat', r'(?P<Y>\d\d(?P<y>\d\d))(?P<M>\d\d)(?P<D>\d\d).*\.dat$',
+             '{Y}/{y}{M}/{y}{M}{D}', 'UT{Y}{M}{D}_VLF_{name}.dat'),
+    # UT190101.spd or UT20190101.spd
+    MakeRule('spd', r'..(?P<C>20)?(?P<y>\d\d)(?P<M>\d\d)(?P<D>\d\d)(?P<rest>.*)\.spd$',
+             '20{y}/{y}{M}/{y}{M}{D}', 'UT20{y}{M}{D}{rest}_VLF_{name}.spd'),
+    # Staribus4ChannelLogger_RawData_20190101_000021.xml
+    MakeRule('xml', r'(?P<logger>[^_]*)_(?P<kind>[^_]*)_(?P<date>\d\d(?P<y>\d\d)(?P<M>\d\d)(?P<D>\d\d))_(?P<time>[^_]*)\.xml$',
+             '20{y}/{y}{M}/{y}{M}{D}', 'UT{date}_{time}_{logger}_{kind}_VLF_{name}.xml'),
+    # UT20110307_UKRAA_Rx_VLF_SDawes.csv keeps its name
+    MakeRule('csv', r'(?P<file>..(?P<Y>\d\d(?P<y>\d\d))(?P<M>\d\d)(?P<D>\d\d).*\.csv)$',
+             '{Y}/{y}{M}/{y}{M}{D}', '{file}'),
+    )
+
+# The naming convention UTYYMMDD[0HHSS]_VLF_[Name].[Suffix] used by sidsort.py
+ShortYearRules = (
+    # 20190101.dat
+    MakeRule('dat', r'(?P<Y>\d\d(?P<y>\d\d))(?P<M>\d\d)(?P<D>\d\d).*\.dat$',
+             '{Y}/{y}{M}/{y}{M}{D}', 'UT{y}{M}{D}_VLF_{name}.dat'),
+    # UT190101.spd
+    MakeRule('spd', r'(?P<stem>..(?P<y>\d\d)(?P<M>\d\d)(?P<D>\d\d).*)\.spd$',
+             '20{y}/{y}{M}/{y}{M}{D}', '{stem}_VLF_{name}.spd'),
+    )
+
+# What sidsort.py's own command line has always done: the short rules, but
+# the .spd files there have always been Colin Clements' files
+SidsortRules = (
+    ShortYearRules[0],
+    MakeRule('spd', r'(?P<stem>..(?P<y>\d\d)(?P<M>\d\d)(?P<D>\d\d).*)\.spd$',
+             '20{y}/{y}{M}/{y}{M}{D}', '{stem}_VLF_CClements.spd'),
+    )
+
+# rule tables by the name used for them in sidbatch.py configuration files
+RuleTables = {'long': LongYearRules, 'short': ShortYearRules}
+
+
+class Classifier:
+    '''
+    Works out the new home of files using a table of rules.
+    '''
+
+    def __init__(self, rules, outdir, name):
+        self.outdir = outdir
+        self.name = name
+        self.rules = {rule.suffix: rule for rule in rules}
+        # what a zip archive is recorded in the index under, so one sorted
+        # for another observer, or with other rules, is looked inside again
+        self.fingerprint = '{:08x}'.format(zlib.crc32(repr(
+            [(rule.suffix, rule.pattern.pattern, rule.NewDir, rule.NewFileName) for rule in rules]).encode('utf-8')))
+        self.key = '{}#{}#{}'.format(outdir, name, self.fingerprint)
+
+    def classify(self, file):
+        '''
+        Returns (NewDir, NewFileName), or None for files that are not sorted.
+        '''
+        rule = self.rules.get(file[-3:])
+        if rule is None:
+            return None
+        match = rule.pattern.match(file)
+        if match is None:
+            return None
+        fields = match.groupdict()
+        fields['name'] = self.name
+        return ('{}/{}'.format(self.outdir, rule.NewDir.format_map(fields)),
+                rule.NewFileName.format_map(fields))
+
+    def classify_all(self, subdir, files):
+        '''
+        Plan a whole directory listing at once. Returns the PlanItems and the
+        names of the files that are not sorted.
+        '''
+        classify = self.classify
+        items = []
+        skipped = []
+        for file in files:
+            NewName = classify(file)
+            if NewName is None:
+                skipped.append(file)
+            else:
+                items.append(PlanItem(os.path.join(subdir, file), None, file, *NewName))
+        return items, skipped
+
+
+class Plan:
+    '''
+    Everything a sort is going to do, worked out before anything is copied.
+        items     - PlanItems in the order the files were found
+        skipped   - files, and zip members, that do not match any rule
+        zips      - zip archives that were looked inside
+        badzips   - .zip files that could not be read
+        unchanged - how many files the index shows are already sorted
+        key       - the Classifier's key, which the zips are recorded under
+    '''
+
+    def __init__(self, key=None):
+        self.key = key
+        self.items = []
+        self.skipped = []
+        self.zips = []
+        self.badzips = []
+        self.unchanged = 0
+
+
+def Wanted(classifier):
+    '''The three letter suffixes of the files worth looking at.'''
+    return set(classifier.rules) | {'zip'}
+
+
+def MakePlan(indir, classifier, index=None, metrics=None, workers=1):
+    '''
+    Walk indir, listing up to workers folders at once, and plan where every
+    file goes. The output tree is not walked. Files the sidindex.SortIndex
+    shows were sorted on an earlier run, and have not changed, are left out.
+    Time spent and files skipped are added to the sidmetrics.Metrics if given.
+    '''
+    if metrics is None:
+        metrics = sidmetrics.Metrics()
+    plan = Plan(classifier.key)
+    wanted = Wanted(classifier)
+    walker = sidwalk.Walk(indir, classifier.outdir, workers)
+    while True:
+        with metrics.timer('walk'):
+            folder = next(walker, None)
+        if folder is None:
+            break
+        subdir, entries = folder
+        PlanFolder(plan, subdir, entries, classifier, index, metrics, wanted)
+    metrics.count('badzip', n=len(plan.badzips))
+    return plan
+
+
+def PlanFiles(entries, classifier, index=None, metrics=None):
+    '''
+    Plan just the files given, such as those found by sidwatch, rather than
+    walking a folder. entries need the name, path and stat() of an os.DirEntry.
+    '''
+    if metrics is None:
+        metrics = sidmetrics.Metrics()
+    plan = Plan(classifier.key)
+    wanted = Wanted(classifier)
+    folders = {}
+    for entry in entries:
+        folders.setdefault(os.path.dirname(entry.path), []).append(entry)
+    for subdir, files in folders.items():
+        PlanFolder(plan, subdir, files, classifier, index, metrics, wanted)
+    metrics.count('badzip', n=len(plan.badzips))
+    return plan
+
+
+def PlanFolder(plan, subdir, entries, classifier, index, metrics, wanted):
+    '''
+    Add the files of one folder, given as os.DirEntry, to the plan.
+    '''
+    skipped_before = len(plan.skipped)
+    files = {}
+    # files with any other suffix are skipped without looking at them further
+    for entry in entries:
+        if entry.name[-3:] in wanted:
+            files[entry.name] = entry
+        else:
+            plan.skipped.append(entry.name)
+    with metrics.timer('classify'):
+        zips = [file for file in files if file[-3:] == 'zip']
+        items, skipped = classifier.classify_all(subdir, [file for file in files if file[-3:] != 'zip'])
+        plan.skipped.extend(skipped)
+    if index is not None:
+        with metrics.timer('stat'):
+            items = [item for item in items
+                     if not Unchanged(plan, index, files[item.file], '{}/{}'.format(item.NewDir, item.NewFileName),
+                                      metrics)]
+            zips = [file for file in zips if not Unchanged(plan, index, files[file], classifier.key, metrics)]
+    plan.items.extend(items)
+    with metrics.timer('classify'):
+        for file in zips:
+            PlanZip(plan, os.path.join(subdir, file), classifier)
+    for file in plan.skipped[skipped_before:]:
+        metrics.count('skipped', file)
+
+
+def Unchanged(plan, index, entry, destination, metrics):
+    '''
+    True if the index shows entry was sorted to destination on an earlier
+    run and has not changed since, and so can be left out of the plan.
+    destination is where it is to go now, or for a zip archive the
+    Classifier's key. A file whose sorted copy has since gone is sorted again.
+    '''
+    try:
+        st = entry.stat()
+    except OSError:
+        return False
+    if not index.unchanged(entry.path, st, destination):
+        return False
+    if entry.name[-3:] != 'zip' and not os.path.isfile(destination):
+        return False
+    plan.unchanged += 1
+    metrics.count('unchanged', entry.name)
+    return True
+
+
+def PlanZip(plan, path, classifier):
+    '''
+    Add the members of a zip archive, from any folder inside it, to the plan.
+    Only the archive's directory is read, nothing is unpacked.
+    '''
+    try:
+        with zipfile.ZipFile(path) as Archive:
+            infos = Archive.infolist()
+    except (zipfile.BadZipFile, OSError):
+        plan.badzips.append(path)
+        return
+    plan.zips.append(path)
+    for info in infos:
+        if info.is_dir():
+            continue
+        # member names always use / whatever the system
+        file = info.filename.rsplit('/', 1)[-1]
+        NewName = classifier.classify(file)
+        if NewName is None:
+            plan.skipped.append('{}/{}'.format(os.path.basename(path), info.filename))
+        else:
+            plan.items.append(PlanItem(path, info.filename, file, *NewName))
+
+
+def Source(item):
+    '''The path of a planned file, or of the member of a zip archive as archive/member.'''
+    return item.source if item.member is None else '{}/{}'.format(item.source, item.member)
+
+
+# how ShardPlan splits a plan
+ShardBy = ('date', 'path')
+
+
+def ShardPlan(plan, outdir, shard, shards, by='date'):
+    '''
+    Keep only the items of plan in shard (1 to shards) and return how many
+    were left out. by='date' keeps each day's files together, 'path' splits
+    them by new name. Either way a destination is always in the same shard,
+    whatever machine or input folder it is worked out on.
+    '''
+    kept = []
+    for item in plan.items:
+        # the path below outdir, which is the same on every machine
+        key = os.path.relpath(item.NewDir, outdir).replace(os.sep, '/')
+        if by == 'path':
+            key = '{}/{}'.format(key, item.NewFileName)
+        if zlib.crc32(key.encode('utf-8')) % shards == shard - 1:
+            kept.append(item)
+    left = len(plan.items) - len(kept)
+    plan.items = kept
+    return left
+
+
+def Execute(plan, Copier, exists=None, Dirs=None, notice=None):
+    '''
+    Carry out a plan with a sidcopy.CopyQueue. exists(NewDir, NewFileName) is
+    called for each file that is already in the output folder, and with the
+    copier's verify option notice(outcome, NewDir, NewFileName, twin) for each
+    file that is a DUPLICATE of another sorted file, twin, or a CONFLICT.
+    Files with the same name and data, IDENTICAL, are passed to exists.
+    Directories are made through the sidcopy.DirCache Dirs, or a new one.
+    Timings and counts go to the copier's sidmetrics.Metrics, if it has one.
+    Returns the number of files copied.
+    '''
+    if Dirs is None:
+        Dirs = sidcopy.DirCache()
+    metrics = Copier.metrics if Copier.metrics is not None else sidmetrics.Metrics()
+    numfiles = 0
+    Archive = None
+    try:
+        for item in plan.items:
+            extract = None
+            if item.member is not None:
+                if Archive is None or Archive.filename != item.source:
+                    if Archive is not None:
+                        # the archive must stay open until all of its members are copied
+                        Copier.wait()
+                        Archive.close()
+                    Archive = zipfile.ZipFile(item.source)
+                extract = partial(sidcopy.ExtractMember, Archive, Archive.getinfo(item.member))
+            # make the directory unless it has already been made or seen this run
+            with metrics.timer('mkdir'):
+                Dirs.make(item.NewDir)
+            # copy the file to the new directory so long as it does not already exist
+            outcome = Copier.add(Source(item), item.NewDir, item.NewFileName, item.file, extract)
+            metrics.count(outcome, item.file)
+            if outcome in (sidcopy.COPIED, sidcopy.VERSIONED):
+                numfiles += 1
+            elif outcome in (sidcopy.EXISTS, sidcopy.IDENTICAL):
+                if exists is not None:
+                    exists(item.NewDir, item.NewFileName)
+            elif notice is not None:
+                notice(outcome, item.NewDir, item.NewFileName, Copier.twin)
+        Copier.wait()
+    finally:
+        if Archive is not None:
+            Archive.close()
+    # every member of these archives is now sorted
+    if Copier.index is not None:
+        for path in plan.zips:
+            Copier.index.record(path, plan.key)
+    return numfiles
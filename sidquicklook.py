@@ -0,0 +1,210 @@
+'''
+###  sidquicklook.py
+###  Daily quicklook summaries of the sorted SID data
+###
+###**************************
+###  Usage: py sidquicklook.py -o=./output_path
+###  py sidquicklook.py -h (command line help)
+###  or sidsort.py --quicklook to summarise the days that get new files as they are sorted.
+###
+###  For every YYYY/YYMM/YYMMDD day folder a small JSON file is written next
+###  to it, YYYY/YYMM/YYMMDD.quicklook.json, holding for each observer's data
+###  on that day:
+###    - the number of samples, the first and last time
+###    - the min, max and mean of each channel over the day
+###    - a trace of the min, max and mean of each channel in fixed bins,
+###      one minute by default. Only the bins with data are kept: 'bins'
+###      lists their numbers, counting from 0 at midnight.
+###  so the portal can show a day without reading its data files.
+###
+###  The numbers come from the .npy files made by sidconvert.py, which are
+###  made first where needed, and are worked out with NumPy a whole day at
+###  a time. NumPy must be installed for this, unlike the rest of sidsort.
+###  A day is only summarised again when its .npy files are newer than its
+###  quicklook file.
+###
+###  The quicklook file is shared by every observer of the day, so several
+###  sidbatch jobs may write it at once. Each reads every station, writes,
+###  then looks again: if any .npy file changed while it was working it
+###  summarises the day again. The last to write has read them all.
+###
+###**************************
+'''
+import os, datetime, time
+import argparse
+import json
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import sidconvert
+import sidcopy
+
+# seconds in each bin of the traces
+BIN_SECONDS = 60
+Suffix = '.quicklook.json'
+
+
+def SidecarPath(daydir):
+    '''The quicklook file for a day folder, beside it in the month folder.'''
+    return os.path.normpath(daydir) + Suffix
+
+
+def Numbers(values):
+    '''A list of floats for JSON, None where there is no data.'''
+    return [None if value != value else float('{:.6g}'.format(value)) for value in values.tolist()]
+
+
+def Summarise(times, values, midnight, bin_seconds=BIN_SECONDS):
+    '''
+    The summary of one observer's day. times is a float64 array of seconds
+    since 1970 and values a (channels, samples) array, as sidconvert writes them.
+    '''
+    values = numpy.asarray(values, dtype=numpy.float64)
+    nbins = -(-86400 // bin_seconds)
+    station = {
+        'samples': int(times.size),
+        'first': float(times.min()) if times.size else None,
+        'last': float(times.max()) if times.size else None,
+        'channels': [],
+        'trace': {'bins': [], 'min': [], 'max': [], 'mean': []},
+        }
+    if not times.size:
+        return station
+    # samples outside the day are left out of the traces but not the day's figures
+    bins = numpy.floor((times - midnight) / bin_seconds).astype(numpy.int64)
+    inside = (bins >= 0) & (bins < nbins)
+    order = numpy.argsort(bins[inside], kind='stable')
+    binned = bins[inside][order]
+    # where each run of samples in the same bin starts
+    starts = numpy.flatnonzero(numpy.r_[True, binned[1:] != binned[:-1]]) if binned.size else binned
+    used = binned[starts]
+    finite = numpy.isfinite(values)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        counts = finite.sum(axis=1)
+        daymean = numpy.where(finite, values, 0).sum(axis=1) / counts
+        for count, low, high, mean in zip(counts.tolist(), Numbers(numpy.fmin.reduce(values, axis=1)),
+                                          Numbers(numpy.fmax.reduce(values, axis=1)), Numbers(daymean)):
+            station['channels'].append({'count': count, 'min': low, 'max': high, 'mean': mean})
+        if not used.size:
+            return station
+        sorted_values = values[:, inside][:, order]
+        sorted_finite = finite[:, inside][:, order]
+        binsums = numpy.add.reduceat(numpy.where(sorted_finite, sorted_values, 0), starts, axis=1)
+        bincounts = numpy.add.reduceat(sorted_finite, starts, axis=1)
+        trace = {'min': numpy.fmin.reduceat(sorted_values, starts, axis=1),
+                 'max': numpy.fmax.reduceat(sorted_values, starts, axis=1),
+                 'mean': binsums / bincounts}
+    station['trace']['bins'] = used.tolist()
+    for key, rows in trace.items():
+        station['trace'][key] = [Numbers(row) for row in rows]
+    return station
+
+
+def Stations(daydir):
+    '''{name: stem} for the .npy pairs in a day folder, name being Observer_suffix.'''
+    stations = {}
+    try:
+        files = sorted(os.listdir(daydir))
+    except OSError:
+        return stations
+    for file in files:
+        if file.endswith('.time.npy') and '_VLF_' in file:
+            stem = os.path.join(daydir, file[:-len('.time.npy')])
+            if os.path.isfile(stem + '.values.npy'):
+                stations[file[:-len('.time.npy')].split('_VLF_', 1)[1]] = stem
+    return stations
+
+
+def Modified(stations):
+    '''{stem: (mtime of .time.npy, mtime of .values.npy)} for stations, as Stations gives them.'''
+    modified = {}
+    for stem in stations.values():
+        try:
+            modified[stem] = tuple(os.stat(stem + end).st_mtime_ns for end in ('.time.npy', '.values.npy'))
+        except OSError:
+            modified[stem] = None
+    return modified
+
+
+def SummariseDay(daydir, bin_seconds=BIN_SECONDS):
+    '''
+    Write the quicklook file for a day folder if its .npy files have
+    changed since it was last written. Returns True if it was written.
+    '''
+    midnight = sidconvert.Midnight(daydir)
+    if midnight is None:
+        return False
+    stations = Stations(daydir)
+    if not stations:
+        return False
+    sidecar = SidecarPath(daydir)
+    try:
+        made = os.stat(sidecar).st_mtime_ns
+    except OSError:
+        made = None
+    if made is not None and all(os.stat(stem + end).st_mtime_ns <= made
+                                for stem in stations.values() for end in ('.time.npy', '.values.npy')):
+        with open(sidecar, encoding='utf-8') as f:
+            # a different bin size means it has to be done again
+            if json.load(f).get('bin_seconds') == bin_seconds:
+                return False
+
+    def write(temp):
+        with open(temp, mode='wt', encoding='utf-8') as f:
+            json.dump(summary, f, separators=(',', ':'))
+    while True:
+        before = Modified(stations)
+        summary = {
+            'day': time.strftime('%Y-%m-%d', time.gmtime(midnight)),
+            'bin_seconds': bin_seconds,
+            'stations': {},
+            }
+        for name, stem in stations.items():
+            times = numpy.load(stem + '.time.npy', mmap_mode='r')
+            values = numpy.load(stem + '.values.npy', mmap_mode='r')
+            summary['stations'][name] = Summarise(numpy.asarray(times), values, midnight, bin_seconds)
+        sidcopy.Atomic(write, sidecar)
+        # another observer's job may have converted a station since, and
+        # written before this did; if so this one must read it too
+        stations = Stations(daydir)
+        if Modified(stations) == before:
+            return True
+
+
+def SummariseCopied(copied, bin_seconds=BIN_SECONDS):
+    '''
+    Summarise the days that files have just been copied into, converting
+    them first. copied is a list of (NewDir, NewFileName).
+    Returns the number of station-days converted and of days summarised.
+    '''
+    converted = sidconvert.ConvertCopied(copied)
+    days = sorted({NewDir for NewDir, NewFileName in copied})
+    return converted, sum(SummariseDay(daydir, bin_seconds) for daydir in days)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a quicklook summary of each day of sorted SID data')
+    parser.add_argument('-o', '--o', dest='outdir', default='./',
+                        help='Sorted files directory default is ./')
+    parser.add_argument('-b', '--bin', dest='bin', type=int, default=BIN_SECONDS,
+                        help='Seconds in each bin of the traces, default is {}'.format(BIN_SECONDS))
+    args = parser.parse_args(argv)
+    if numpy is None:
+        print('NumPy is needed for the quicklook summaries: pip install numpy')
+        return 1
+    StartTime = time.time()
+    print('Sidquicklook started {}'.format(datetime.datetime.now().time()))
+    days = sidconvert.DayFolders(args.outdir)
+    for daydir in days:
+        sidconvert.ConvertDay(daydir)
+    summarised = sum(SummariseDay(daydir, args.bin) for daydir in days)
+    print('{} of {} days summarised in {:.3f} seconds'.format(summarised, len(days), time.time() - StartTime))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
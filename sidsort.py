@@ -14,37 +14,431 @@
 ###  also absolute paths can be used: 
 ###  py sidsort.py -i=c:\input_path -o=c:\output_path
 ###  py sidsort.py -h (command line help)
+###  py sidsort.py -i=./input_path -o=./output_path --watch (keep sorting new files)
+###  py sidsort.py -i=./input_path -o=./output_path --shard 2/4 (the 2nd quarter, on one of 4 machines)
 ###  Forward and backwards slashes are both acceptable \ and /
 ###
+###  The sort can also be run from other Python code without the command line:
+###      import sidsort
+###      result = sidsort.sort_tree('./input_path', './output_path', 'JCook')
+###      print(result.copied, result.unchanged)
+###  Importing sidsort only loads what a sort needs; nothing runs until
+###  sort_tree(), or main() for the command line, is called.
+###
 ###**************************
 ###  v0.2b Added Colin Clements file types
 ###  v0.3b Few tweeks to filename handling
 ###  v1.1  Added .zip file handling
 ###  v1.1.1 Added licenceing statement
+###  v1.2  .dat and .spd files inside .zip archives are sorted too
+###  v1.3  Filename rules moved to sidplan.py, added --dry-run
+###  v1.4  Messages go through logging, added --quiet, --log-level and --metrics-json
+###  v1.5  Added --verify and --on-conflict to compare file contents
+###  v1.6  Added --watch to sort new files as they arrive
+###  v1.7  Added --convert to write each day's data as .npy files
+###  v1.8  Added --quicklook for daily summaries
+###  v1.9  sort_tree() and watch_tree() can be imported, the command line is in main()
+###  v1.10 Added --bundle to put each observer's files for a day in one archive
+###  v1.11 Files are renamed into place once written, added a journal to carry on
+###        after a stop, and --shard to split a sort between machines
 '''
 import os, datetime, time
-import argparse
-import shutil
+import logging
+import sys
+import sidcopy
+import sidindex
+import sidmetrics
+import sidplan
 
-version = '1.1'
+version = '1.11'
 name = 'JCook'  # hardcoded for this script but could be passed as a paramitter
 
-# setup the commandline argument handler
-parser = argparse.ArgumentParser()
-# command line argument to take the input path where the .dat files are
-parser.add_argument('-i', '--i', dest = 'indir', default = './', 
-                    help = 'Input files directory default is ./')
-# command line argument that takes the path where the output files go
-parser.add_argument('-o', '--o', dest = 'outdir', default = './', 
-                    help = 'Output files directory default is ./')
+# every message goes through here: one line per file at DEBUG, totals at INFO
+log = logging.getLogger('sidsort')
+
+
+class SortResult:
+    '''
+    What a sort did.
+        copied     - number of files copied
+        unchanged  - files passed over because the index shows they were
+                     sorted on an earlier run and have not changed
+        planned    - number of files that matched a rule
+        skipped    - files, and zip members, that do not match any rule
+        zips       - zip archives that were looked inside
+        badzips    - .zip files that could not be read
+        converted  - station-days converted to .npy, with convert
+        summarised - days summarised, with quicklook
+        bundled    - day bundles written, with bundle
+        resumed    - files passed over as the journal shows an earlier,
+                     stopped, run of the same sort finished with them
+        elsewhere  - files left to the other shards, with shard
+        metrics    - the sidmetrics.Metrics of the run
+    '''
+
+    def __init__(self, metrics):
+        self.copied = 0
+        self.unchanged = 0
+        self.planned = 0
+        self.skipped = []
+        self.zips = []
+        self.badzips = []
+        self.converted = 0
+        self.summarised = 0
+        self.bundled = 0
+        self.resumed = 0
+        self.elsewhere = 0
+        self.metrics = metrics
+
+    def add(self, other):
+        '''Add in the results of another sort, such as a batch of watch_tree.'''
+        self.copied += other.copied
+        self.unchanged += other.unchanged
+        self.planned += other.planned
+        self.skipped.extend(other.skipped)
+        self.zips.extend(other.zips)
+        self.badzips.extend(other.badzips)
+        self.converted += other.converted
+        self.summarised += other.summarised
+        self.bundled += other.bundled
+        self.resumed += other.resumed
+        self.elsewhere += other.elsewhere
+
+
+def sort_tree(input, output, observer=name, rules='short', workers=1, rescan=False, mode='copy',
+              dry_run=False, verify=False, on_conflict='flag', convert=False, quicklook=False,
+              bundle=None, shard=None, shard_by='date', journal=None, progress=None, logger=None,
+              files=None, index=None, dirs=None, metrics=None):
+    '''
+    Sort the SID data files in input, and its folders and zip files, into
+    YYYY/YYMM/YYMMDD folders under output with their new names, and return
+    a SortResult.
+        observer    - the name that goes in the new file names
+        rules       - 'short' for UTYYMMDD..._VLF_[Name], 'long' for
+                      UTYYYYMMDD..._VLF_[Name] as vsidsort.py does, or a
+                      table of sidplan rules such as sidplan.SidsortRules,
+                      which the command line uses
+        workers     - folders listed and files copied at once
+        rescan      - check every file, not just those new since the last run
+        mode        - one of sidcopy.Modes
+        dry_run     - only log where each file would go
+        verify, on_conflict - compare contents, see sidcopy.CopyQueue
+        convert     - convert the days that get new files, see sidconvert
+        quicklook   - convert and summarise them, see sidquicklook (needs NumPy)
+        bundle      - 'zip', 'tar.gz' or 'tar.zst' to write the files of each
+                      observer on the days that get new files into one
+                      archive, with up to workers days at once; see sidbundle
+        shard       - (i, N) to sort only the i-th of N parts of the files, so
+                      N machines can sort one input into one output between
+                      them; shard_by is 'date' or 'path', see sidplan.ShardPlan.
+                      Each shard keeps an index of its own
+        journal     - a file to record each file in as it is done, see
+                      sidjournal. If it holds a stopped run of the same sort
+                      the files done by that run are passed over
+        progress    - called as progress(done, total) once the files to sort
+                      are known and after each one
+        logger      - a logging.Logger for the messages, the 'sidsort' logger if not given
+    files, index, dirs and metrics are for watch_tree: just the files given
+    (sidwatch.Arrivals) are sorted, through an open SortIndex and DirCache,
+    with timings and counts added to an existing Metrics.
+    Raises FileNotFoundError if input is not a folder.
+    '''
+    if logger is None:
+        logger = log
+    if not os.path.isdir(input):
+        raise FileNotFoundError('Input Directory does not exist: {}'.format(input))
+    if not dry_run:
+        os.makedirs(output, exist_ok=True)
+    if isinstance(rules, str):
+        rules = sidplan.RuleTables[rules]
+    if quicklook:
+        import sidquicklook
+        if sidquicklook.numpy is None:
+            raise ImportError('quicklook needs NumPy: pip install numpy')
+    elif convert:
+        import sidconvert
+    if bundle:
+        import sidbundle
+        sidbundle.Check(bundle)
+    if metrics is None:
+        metrics = sidmetrics.Metrics()
+    result = SortResult(metrics)
+    # only build the per-file messages if they are going to be shown
+    listing = logger.isEnabledFor(logging.DEBUG)
+    # index of the files sorted on earlier runs, kept in the output directory
+    OwnIndex = index is None
+    if OwnIndex:
+        IndexName = sidindex.ShardIndexName.format(*shard) if shard else sidindex.IndexName
+        if not dry_run:
+            index = sidindex.SortIndex(output, rescan, IndexName)
+        elif os.path.isfile(os.path.join(output, IndexName)):
+            # a dry run reads the index of earlier runs but leaves the output alone
+            index = sidindex.SortIndex(output, rescan, IndexName, readonly=True)
+    Journal = None
+    try:
+        Classifier = sidplan.Classifier(rules, output, observer)
+        if files is None:
+            # work out where every file goes - including all subdirectories and zip files,
+            # but not the output directory - listing several directories at once
+            Plan = sidplan.MakePlan(input, Classifier, index, metrics, workers)
+        else:
+            Plan = sidplan.PlanFiles(files, Classifier, index, metrics)
+        if shard:
+            result.elsewhere = sidplan.ShardPlan(Plan, output, shard[0], shard[1], shard_by)
+            logger.info('Shard %s of %s: %s files to sort here, %s left to the other shards',
+                        shard[0], shard[1], len(Plan.items), result.elsewhere)
+        if journal and not dry_run:
+            import sidjournal
+            Journal = sidjournal.Journal(journal, {
+                'input': os.path.abspath(input), 'output': os.path.abspath(output), 'observer': observer,
+                'rules': Classifier.fingerprint, 'shard': shard, 'shard_by': shard_by if shard else None})
+            if Journal.resumed:
+                items = []
+                for item in Plan.items:
+                    if sidplan.Source(item) in Journal.done:
+                        result.resumed += 1
+                        metrics.count('resumed', item.file)
+                    else:
+                        items.append(item)
+                Plan.items = items
+                logger.info('Carrying on from the stopped run in %s, %s files already done', journal, result.resumed)
+        result.unchanged = Plan.unchanged
+        result.planned = len(Plan.items)
+        result.skipped = Plan.skipped
+        result.zips = Plan.zips
+        result.badzips = Plan.badzips
+        for path in Plan.zips:
+            logger.debug('ZIP file found...looked inside %s for .dat and .spd files', path)
+        for path in Plan.badzips:
+            logger.warning('%s is not a readable zip file - skipped', path)
+        if listing:
+            for file in Plan.skipped:
+                # not a .dat or .spd file!
+                logger.debug('%s skipped', file)
+        
+        if dry_run:
+            # list what would be done but leave the output directory alone
+            for item in Plan.items:
+                if os.path.isfile('{}/{}'.format(item.NewDir, item.NewFileName)):
+                    logger.debug('%s/%s - File already exists!', item.NewDir, item.NewFileName)
+                else:
+                    logger.debug('%s >> %s would be copied to %s', item.file, item.NewFileName, item.NewDir)
+            return result
+        
+        done = [0]
+        
+        def Progressed():
+            done[0] += 1
+            if progress is not None:
+                progress(done[0], result.planned)
+        
+        def Exists(NewDir, NewFileName):
+            logger.debug('%s/%s - File already exists!', NewDir, NewFileName)
+            Progressed()
+        
+        def Notice(outcome, NewDir, NewFileName, twin):
+            if outcome == sidcopy.DUPLICATE:
+                logger.debug('%s/%s - Same data already sorted as %s', NewDir, NewFileName, twin)
+            else:
+                logger.warning('%s/%s - File already exists with different data!', NewDir, NewFileName)
+            Progressed()
+        
+        # the new files, for convert, quicklook and bundle
+        copied = []
+        
+        def Copied(file, NewFileName, NewDir):
+            logger.debug('%s >> %s copied to %s', file, NewFileName, NewDir)
+            if convert or quicklook or bundle:
+                copied.append((NewDir, NewFileName))
+            Progressed()
+        
+        if progress is not None:
+            progress(0, result.planned)
+        # copies are queued here and run on several threads
+        Copier = sidcopy.CopyQueue(workers, report = Copied, index = index, mode = mode, metrics = metrics,
+                                   verify = verify, on_conflict = on_conflict, journal = Journal)
+        try:
+            # output directories that already exist are read once up front
+            result.copied = sidplan.Execute(Plan, Copier, exists = Exists,
+                                            Dirs = dirs or sidcopy.DirCache(output), notice = Notice)
+        finally:
+            # wait for the last copies to finish before reporting the total
+            Copier.finish()
+        if copied and quicklook:
+            with metrics.timer('convert'):
+                result.converted, result.summarised = sidquicklook.SummariseCopied(copied)
+            logger.info('%s station-days converted to .npy', result.converted)
+            logger.info('%s days summarised', result.summarised)
+        elif copied and convert:
+            with metrics.timer('convert'):
+                result.converted = sidconvert.ConvertCopied(copied)
+            logger.info('%s station-days converted to .npy', result.converted)
+        if copied and bundle:
+            with metrics.timer('bundle'):
+                result.bundled = sidbundle.BundleCopied(copied, bundle, workers)
+            logger.info('%s day bundles written', result.bundled)
+        if Journal is not None:
+            Journal.finish(copied = result.copied, unchanged = result.unchanged, resumed = result.resumed,
+                           planned = result.planned)
+    finally:
+        if Journal is not None:
+            # still open if the sort was stopped, so the next run carries on
+            Journal.close()
+        if OwnIndex and index is not None:
+            index.close()
+    return result
+
+
+def watch_tree(input, output, observer=name, rules='short', rescan=False, settle=None, interval=None,
+               poll=False, stop=None, logger=None, metrics=None, **options):
+    '''
+    Sort the files in input, and then each new file as it arrives, until
+    stop (a threading.Event) is set or Ctrl+C is pressed. A file is only
+    sorted once it has not changed for settle seconds, so nothing half
+    uploaded is copied; see sidwatch. The other options are those of
+    sort_tree. Returns a SortResult with the totals.
+    '''
+    import sidwatch
+    if logger is None:
+        logger = log
+    if isinstance(rules, str):
+        rules = sidplan.RuleTables[rules]
+    if settle is None:
+        settle = sidwatch.SETTLE
+    if interval is None:
+        interval = sidwatch.INTERVAL
+    if not os.path.isdir(input):
+        raise FileNotFoundError('Input Directory does not exist: {}'.format(input))
+    os.makedirs(output, exist_ok=True)
+    if metrics is None:
+        metrics = sidmetrics.Metrics()
+    total = SortResult(metrics)
+    Index = sidindex.SortIndex(output, rescan)
+    Dirs = sidcopy.DirCache(output)
+    
+    def SortBatch(batch):
+        result = sort_tree(input, output, observer, rules, logger = logger, files = batch,
+                           index = Index, dirs = Dirs, metrics = metrics, **options)
+        Index.commit()
+        total.add(result)
+        logger.info('%s new files sorted, %s copied', len(batch), result.copied)
+    
+    try:
+        sidwatch.Watch(input, output,
+                       sidplan.Wanted(sidplan.Classifier(rules, output, observer)),
+                       SortBatch, settle, interval,
+                       known = Index.unchanged, poll = poll, stop = stop,
+                       started = lambda watcher: logger.info('Watching %s for new files (%s)', input, watcher.kind))
+    except KeyboardInterrupt:
+        logger.info('Stopped watching')
+    finally:
+        Index.close()
+    return total
 
-# create the argument handler object
-args = parser.parse_args()
 
-def initialize():
+def main(argv=None):
+    '''The command line, see the top of this file.'''
+    import argparse
+    # setup the commandline argument handler
+    parser = argparse.ArgumentParser()
+    # command line argument to take the input path where the .dat files are
+    parser.add_argument('-i', '--i', dest = 'indir', default = './', 
+                        help = 'Input files directory default is ./')
+    # command line argument that takes the path where the output files go
+    parser.add_argument('-o', '--o', dest = 'outdir', default = './', 
+                        help = 'Output files directory default is ./')
+    # command line argument that sets how many files are copied at the same time
+    parser.add_argument('-w', '--workers', dest = 'workers', type = int, default = 1,
+                        help = 'Number of directories to list and files to copy at once default is 1')
+    # command line switch to check every file again, ignoring the index of sorted files
+    parser.add_argument('--rescan', dest = 'rescan', action = 'store_true',
+                        help = 'Re-check every input file, not just new or changed ones')
+    # command line argument that says how files get to the output directory
+    parser.add_argument('-m', '--mode', dest = 'mode', choices = sidcopy.Modes, default = 'copy',
+                        help = 'copy, hardlink, reflink or move the files, default is copy')
+    # command line switch to list what would be copied without copying anything
+    parser.add_argument('-n', '--dry-run', dest = 'dryrun', action = 'store_true',
+                        help = 'List where each file would go but do not copy anything')
+    # command line switches to compare file contents rather than just names
+    parser.add_argument('--verify', dest = 'verify', action = 'store_true',
+                        help = 'Compare contents: skip files whose data is already sorted, even under '
+                               'another name, and catch files that differ from the one already sorted')
+    parser.add_argument('--on-conflict', dest = 'onconflict', choices = sidcopy.Conflicts, default = 'flag',
+                        help = 'With --verify, what to do when a file differs from the one already sorted: '
+                               'flag it and leave it, or version it as _v2, _v3... default is flag')
+    # command line switch to convert the data of the days that get new files
+    parser.add_argument('--convert', dest = 'convert', action = 'store_true',
+                        help = 'Also write the data of each observer and day that gets new files as .npy files, '
+                               'see sidconvert.py')
+    # command line switch to summarise the days that get new files
+    parser.add_argument('--quicklook', dest = 'quicklook', action = 'store_true',
+                        help = 'Also convert, and write a quicklook summary of, each day that gets new files, '
+                               'see sidquicklook.py - needs NumPy')
+    # command line argument to bundle each observer's files for the days that get new files
+    parser.add_argument('--bundle', dest = 'bundle', choices = ('zip', 'tar.gz', 'tar.zst'),
+                        help = 'Also write the files of each observer and day that gets new files into one '
+                               'archive, up to --workers days at once, see sidbundle.py - tar.zst needs zstandard')
+    # command line switches to keep running and sort new files as they arrive
+    parser.add_argument('--watch', dest = 'watch', action = 'store_true',
+                        help = 'Keep running and sort new files as they arrive, until stopped with Ctrl+C')
+    parser.add_argument('--settle', dest = 'settle', type = float,
+                        help = 'With --watch, seconds a file must stop changing before it is sorted, '
+                               'default is 5')
+    parser.add_argument('--poll', dest = 'poll', action = 'store_true',
+                        help = 'With --watch, look for new files by listing folders rather than with '
+                               'inotify, which does not see files written to network folders by other machines')
+    parser.add_argument('--poll-interval', dest = 'interval', type = float,
+                        help = 'With --watch, seconds between looks for new files, default is 2')
+    # command line arguments that set how much is printed
+    parser.add_argument('--log-level', dest = 'loglevel', default = 'DEBUG',
+                        choices = ('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help = 'DEBUG lists every file, INFO only the start and the totals, '
+                               'WARNING only problems, default is DEBUG')
+    parser.add_argument('-q', '--quiet', dest = 'loglevel', action = 'store_const', const = 'INFO',
+                        help = 'Do not list every file, same as --log-level=INFO')
+    # command line arguments to split one sort between several machines
+    def Shard(text):
+        try:
+            shard, shards = (int(n) for n in text.split('/'))
+        except ValueError:
+            raise argparse.ArgumentTypeError('give the shard as i/N, such as 2/4, not {}'.format(text))
+        if not 1 <= shard <= shards:
+            raise argparse.ArgumentTypeError('the shard must be from 1 to {}'.format(shards))
+        return shard, shards
+    parser.add_argument('--shard', dest = 'shard', type = Shard,
+                        help = 'Sort only part i of N of the files, such as 2/4, so N machines can sort '
+                               'the same input into a shared output between them')
+    parser.add_argument('--shard-by', dest = 'shardby', choices = sidplan.ShardBy, default = 'date',
+                        help = 'With --shard, split the files by day or by new name, default is date')
+    # command line arguments for the journal a stopped run carries on from
+    parser.add_argument('--journal', dest = 'journal',
+                        help = 'Record each file as it is done in this file, default is '
+                               '.sidsort-journal.jsonl in the output directory, see sidjournal.py')
+    parser.add_argument('--no-journal', dest = 'journal', action = 'store_const', const = '',
+                        help = 'Do not keep a journal')
+    # command line argument that takes a file to save the run statistics in
+    parser.add_argument('--metrics-json', dest = 'metricsjson', 
+                        help = 'Save counts and timings of the run to this JSON file')
+    
+    # create the argument handler object
+    args = parser.parse_args(argv)
+    if args.watch and args.dryrun:
+        parser.error('--watch cannot be used with --dry-run')
+    if args.watch and args.shard:
+        parser.error('--watch cannot be used with --shard')
+    if args.quicklook:
+        import sidquicklook
+        if sidquicklook.numpy is None:
+            parser.error('--quicklook needs NumPy: pip install numpy')
+    if args.bundle == 'tar.zst':
+        import sidbundle
+        if sidbundle.zstandard is None:
+            parser.error('--bundle tar.zst needs Zstandard: pip install zstandard')
+    logging.basicConfig(stream = sys.stdout, format = '%(message)s', level = args.loglevel)
+    
     StartTime = time.time()
-    print('Sidsort version {} started {}'.format(version, datetime.datetime.now().time()))
-    print('''
+    log.info('Sidsort version %s started %s', version, datetime.datetime.now().time())
+    log.info('''
     sidsort.py  Copyright (C) 2016  Rupert Powell
     This program comes with ABSOLUTELY NO WARRANTY.
     This is free software, and you are welcome to redistribute it
@@ -54,115 +448,54 @@ def initialize():
     
     # make sure the input directory exists
     if os.path.isdir(args.indir) is True:
-        print('Sorting files in {}'.format(args.indir))
+        log.info('Sorting files in %s', args.indir)
     else:
-        print('Input Directory does not exist: {}'.format(args.indir))
-        return
+        log.error('Input Directory does not exist: %s', args.indir)
+        return 1
     
-    print('Outputting renamed files in {}'.format(args.outdir))
-    if not os.path.exists(args.outdir):
-        print("Output directory doesn't exist so creating it....")
+    log.info('Outputting renamed files in %s', args.outdir)
+    # nothing is written on a dry run, not even the output directory
+    if not args.dryrun and not os.path.exists(args.outdir):
+        log.info("Output directory doesn't exist so creating it....")
         os.makedirs(args.outdir)    
     
-    # call the copy function and get back the number of files copied    
-    numfiles = CopyFile()
+    # sort the files and get back what was done
+    options = dict(workers = args.workers, mode = args.mode, verify = args.verify,
+                   on_conflict = args.onconflict, convert = args.convert, quicklook = args.quicklook,
+                   bundle = args.bundle)
+    if args.watch:
+        result = watch_tree(args.indir, args.outdir, name, sidplan.SidsortRules, rescan = args.rescan,
+                            settle = args.settle, interval = args.interval, poll = args.poll, **options)
+    else:
+        journal = args.journal
+        if journal is None:
+            import sidjournal
+            journal = sidjournal.JournalPath(args.outdir, args.shard)
+        result = sort_tree(args.indir, args.outdir, name, sidplan.SidsortRules, rescan = args.rescan,
+                           dry_run = args.dryrun, shard = args.shard, shard_by = args.shardby, journal = journal,
+                           **options)
+    Metrics = result.metrics
+    Metrics.finish()
     # get the time now in order to calculate how long it all took
     EndTime = time.time()
-    print('Sidsort finished at {}'.format(datetime.datetime.now().time()))
-    print('Files copied = {} in {:.3f} seconds'.format(numfiles, EndTime-StartTime))
+    log.info('Sidsort finished at %s', datetime.datetime.now().time())
+    for line in Metrics.summary():
+        log.info(line)
+    log.info('Unchanged files passed over = %s', result.unchanged)
+    if result.resumed:
+        log.info('Files done by the stopped run = %s', result.resumed)
+    if result.elsewhere:
+        log.info('Files left to the other shards = %s', result.elsewhere)
+    log.info('Files copied = %s in %.3f seconds', result.copied, EndTime-StartTime)
+    if args.metricsjson:
+        Metrics.save(args.metricsjson, version = version, input = args.indir, output = args.outdir,
+                     mode = args.mode, workers = args.workers, dryrun = args.dryrun,
+                     shard = args.shard)
+        log.info('Run statistics saved to %s', args.metricsjson)
+    return 0
     
     ### END OF THE SCRIPT - RETURN TO THE COMMAND PROMPT ###
-       
-def CopyFile():
-    '''
-    Rename the file to meet the following specification:
-    The VLF Data Repository naming convention is UTYYMMDD[0HHSS]_VLF_[Name].[Suffix]
-    '''
-    # Get the filenames from the input directory
-    FileNames = os.listdir(args.indir)
-    # numfiles stores how many files are copied
-    numfiles = 0
-    # Loop through all the names and process them - including all subdirectories
-    for subdir, dirs, files in os.walk(args.indir):
-        for file in files:
-            suffix = file[-3:]
-            # only process .dat file types, skip any other non .dat files
-            if suffix == 'dat':            
-                longyear = file[0:4]
-                year = file[2:4]
-                month = file[4:6]
-                date = file[6:8]
-                # make the new directory path based on the file information
-                NewDir = '{0}/{1}/{2}{3}/{2}{3}{4}'.format(args.outdir, longyear, year, month, date)
-                # check the directory exists and if it does not then create it
-                if not os.path.exists(NewDir):
-                    os.makedirs(NewDir)    
-                
-                # Create the new file name
-                NewFileName = 'UT{0}{1}{2}_VLF_{3}.dat'.format(year, month, date, name)
-                
-                # copy the file to the new directory so long as it does not already exist
-                if not os.path.isfile('{}/{}'.format(NewDir, NewFileName)):
-                    numfiles += 1
-                    # copy and rename the file to the new location
-                    shutil.copy(os.path.join(subdir, file), '{}/{}'.format(NewDir, NewFileName))
-                    print('{} >> {} copied to {}'.format(file, NewFileName, NewDir))
-                else:
-                    print('{0}/{1} - File already exists!'.format( NewDir, NewFileName))
-            elif suffix == 'spd':                
-                NewFileName = '{}_VLF_CClements.spd'.format(file[:-4])
-                #print(NewFileName)
-                year = file[2:4]
-                month = file[4:6]
-                date = file[6:8]
-                # make the new directory path based on the file information
-                longyear = '20{}'.format(year)
-                NewDir = '{0}/{1}/{2}{3}/{2}{3}{4}'.format(args.outdir, longyear, year, month, date)
-                # check the directory exists and if it does not then create it
-                if not os.path.exists(NewDir):
-                    os.makedirs(NewDir)    
-                              
-                # copy the file to the new directory so long as it does not already exist
-                if not os.path.isfile('{}/{}'.format(NewDir, NewFileName)):
-                    numfiles += 1
-                    # copy and rename the file to the new location
-                    shutil.copy(os.path.join(subdir, file), '{}/{}'.format(NewDir, NewFileName))
-                    print('{} >> {} copied to {}'.format(file, NewFileName, NewDir))
-                else:
-                    print('{0}/{1} - File already exists!'.format( NewDir, NewFileName))
-                
-                pass
-            elif suffix == 'zip':
-                print('ZIP file found...looking inside for .SPD files')
-                # Minour change made
-                # Made another minor change
-                #NewFileName = '{}_VLF_CClements.spd'.format(file[:-4])
-                ##print(NewFileName)
-                #year = file[2:4]
-                #month = file[4:6]
-                #date = file[6:8]
-                ## make the new directory path based on the file information
-                #longyear = '20{}'.format(year)
-                #NewDir = '{0}/{1}/{2}{3}/{2}{3}{4}'.format(args.outdir, longyear, year, month, date)
-                ## check the directory exists and if it does not then create it
-                #if not os.path.exists(NewDir):
-                    #os.makedirs(NewDir)    
-                              
-                ## copy the file to the new directory so long as it does not already exist
-                #if not os.path.isfile('{}/{}'.format(NewDir, NewFileName)):
-                    #numfiles += 1
-                    ## copy and rename the file to the new location
-                    #shutil.copy(os.path.join(subdir, file), '{}/{}'.format(NewDir, NewFileName))
-                    #print('{} >> {} copied to {}'.format(file, NewFileName, NewDir))
-                #else:
-                    #print('{0}/{1} - File already exists!'.format( NewDir, NewFileName))
-                
-                pass
-        
-            else:
-                # not a .dat or .spd file!
-                print('{} skipped'.format(file))
-        
-    return numfiles
 
-initialize()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,389 @@
+'''
+###  sidupload.py
+###  Upload the sorted SID data to the BAA data portal
+###
+###**************************
+###  Usage: py sidupload.py -o=./output_path -u=https://portal.example/upload/ -c 4
+###  py sidupload.py -h (command line help)
+###  Run after sidsort.py or sidbatch.py, on the same output folder.
+###
+###  Every sorted UT..._VLF_... data file in the YYYY/YYMM/YYMMDD tree, or
+###  with --bundles every day bundle made by sidbundle.py, is sent to the
+###  portal with an HTTP PUT to the upload address followed by its path in
+###  the tree, e.g.
+###    https://portal.example/upload/2019/1901/190101/UT190101_VLF_JCook.dat
+###  Up to -c files are sent at once, each over a connection that is kept
+###  open and used again for the next file rather than one per file.
+###
+###  A file the portal could not take for the moment (a dropped connection,
+###  a timeout, 429 or a 5xx status) is tried again up to --retries times,
+###  waiting a little longer each time, or as long as the portal asks with
+###  Retry-After. Any other status is reported and the file is left for
+###  the next run.
+###
+###  Each file sent is recorded in the index of sorted files in the output
+###  folder (see sidindex.py) every few seconds, so a run that is stopped
+###  carries on where it left off, and a file is only sent again once it
+###  has changed. The files sent, the MB/s and the time each took - the
+###  50th, 90th and 99th percentile - are reported at the end.
+###
+###**************************
+'''
+import os, datetime, time
+import argparse
+import http.client
+import logging
+import queue
+import random
+import re
+import sys
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import sidbundle
+import sidconvert
+import sidindex
+import sidmetrics
+
+version = '1.0'
+
+log = logging.getLogger('sidupload')
+
+# tries after the first before a file is given up on
+RETRIES = 5
+# seconds before the first retry, doubled for each one after
+BACKOFF = 0.5
+MAX_BACKOFF = 60
+# seconds to wait for the portal to answer
+TIMEOUT = 60
+# bytes sent at a time
+BLOCK_SIZE = 1 << 16
+# seconds between saving which files have been sent
+COMMIT_SECONDS = 5
+# statuses that mean try again later
+Retryable = (408, 425, 429, 500, 502, 503, 504)
+# errors from a kept open connection the portal has since closed
+Stale = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+# the day bundles made by sidbundle.py
+BundleName = re.compile(r'UT\d{8}_VLF_.+\.(?:zip|tar\.gz|tar\.zst)$')
+
+
+class UploadError(Exception):
+    '''A file the portal did not take.'''
+
+
+class ConnectionPool:
+    '''
+    Connections to the portal that are kept open between files. Each upload
+    takes one and gives it back, so there are never more connections than
+    files being sent at once.
+    '''
+
+    def __init__(self, url, timeout=TIMEOUT):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError('Not an http or https address: {}'.format(url))
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+
+    def get(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        self.opened += 1
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout,
+                                               blocksize=BLOCK_SIZE)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout, blocksize=BLOCK_SIZE)
+
+    def put(self, conn):
+        '''Give a connection back. One that has been closed opens again when it is next used.'''
+        self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def RetryAfter(response):
+    '''Seconds the portal asked to wait in a Retry-After header, or None.'''
+    try:
+        return min(MAX_BACKOFF, max(0.0, float(response.getheader('Retry-After'))))
+    except (TypeError, ValueError):
+        return None
+
+
+class Uploader:
+    '''
+    Sends files to the portal over a ConnectionPool. send() can be called
+    from several threads at once.
+    '''
+
+    def __init__(self, url, retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT, headers=None, metrics=None):
+        self.pool = ConnectionPool(url, timeout)
+        self.path = urllib.parse.urlsplit(url).path.rstrip('/')
+        self.retries = retries
+        self.backoff = backoff
+        self.headers = dict(headers or {})
+        self.metrics = metrics
+
+    def target(self, name):
+        '''The path on the portal for a file, name being its path in the sorted tree.'''
+        return '{}/{}'.format(self.path, urllib.parse.quote(name))
+
+    def wait(self, tries):
+        '''Seconds to wait before another try: doubling each time, up to MAX_BACKOFF, with jitter.'''
+        return min(MAX_BACKOFF, self.backoff * 2 ** (tries - 1)) * random.uniform(0.5, 1.0)
+
+    def send(self, path, name, size):
+        '''
+        PUT the file at path, trying again after errors that may pass.
+        Returns (seconds the request that worked took, number of tries).
+        Raises UploadError if the file is not taken.
+        '''
+        headers = dict(self.headers)
+        headers['Content-Length'] = str(size)
+        headers.setdefault('Content-Type', 'application/octet-stream')
+        target = self.target(name)
+        tries = 0
+        while True:
+            conn = self.pool.get()
+            reused = conn.sock is not None
+            start = time.perf_counter()
+            try:
+                with open(path, 'rb') as f:
+                    conn.request('PUT', target, body=f, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+            except FileNotFoundError:
+                self.pool.put(conn)
+                raise UploadError('{} has gone'.format(name))
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                self.pool.put(conn)
+                if reused and isinstance(e, Stale):
+                    # closed by the portal while it was idle, not a failed try
+                    continue
+                tries += 1
+                problem = e.__class__.__name__ if not str(e) else str(e)
+                wait = None
+            else:
+                seconds = time.perf_counter() - start
+                if self.metrics is not None:
+                    self.metrics.add_time('upload', seconds)
+                if response.will_close:
+                    conn.close()
+                self.pool.put(conn)
+                tries += 1
+                if 200 <= response.status < 300:
+                    return seconds, tries
+                problem = '{} {}'.format(response.status, response.reason)
+                if response.status not in Retryable:
+                    raise UploadError('{} - {}'.format(name, problem))
+                wait = RetryAfter(response)
+            if tries > self.retries:
+                raise UploadError('{} - {} after {} tries'.format(name, problem, tries))
+            time.sleep(self.wait(tries) if wait is None else wait)
+
+    def close(self):
+        self.pool.close()
+
+
+def SortedFiles(outdir, bundles=False):
+    '''
+    The sorted data files under outdir, or the day bundles if bundles is
+    True, as (path, path in the tree with / between folders, stat) in date order.
+    '''
+    for daydir in sidconvert.DayFolders(outdir):
+        try:
+            with os.scandir(daydir) as it:
+                entries = sorted((entry for entry in it if entry.is_file()), key=lambda entry: entry.name)
+        except OSError:
+            continue
+        folder = os.path.relpath(daydir, outdir).replace(os.sep, '/')
+        for entry in entries:
+            if bundles:
+                wanted = BundleName.match(entry.name)
+            else:
+                match = sidconvert.SortedName.match(entry.name)
+                wanted = match is not None and match.group('suffix') in sidbundle.Suffixes
+            if wanted:
+                yield entry.path, '{}/{}'.format(folder, entry.name), entry.stat()
+
+
+class UploadResult:
+    '''
+    What an upload run did.
+        uploaded  - number of files sent
+        unchanged - files passed over because they were sent on an earlier run
+        failed    - (path in the tree, reason) of each file the portal did not take
+        retries   - tries made after the first, over all files
+        bytes     - bytes sent
+        latencies - seconds each file sent took, for the request that worked
+        seconds   - time from the first file to the last
+        metrics   - the sidmetrics.Metrics of the run
+    '''
+
+    def __init__(self, metrics):
+        self.uploaded = 0
+        self.unchanged = 0
+        self.failed = []
+        self.retries = 0
+        self.bytes = 0
+        self.latencies = []
+        self.seconds = 0.0
+        self.metrics = metrics
+
+    def summary(self):
+        '''A few lines of text with the counts, speed and percentiles.'''
+        lines = ['Files uploaded = {}, already uploaded = {}, failed = {}, retries = {}'.format(
+            self.uploaded, self.unchanged, len(self.failed), self.retries)]
+        rate = self.bytes / self.seconds / 1e6 if self.seconds else 0.0
+        lines.append('Bytes uploaded = {} in {:.3f} seconds, {:.2f} MB/s, {:.1f} files/s'.format(
+            self.bytes, self.seconds, rate, self.uploaded / self.seconds if self.seconds else 0.0))
+        if self.latencies:
+            lines.append('Time per file ' + ', '.join('{} {:.3f}s'.format(point, seconds) for point, seconds
+                                                      in sidmetrics.Percentiles(self.latencies).items()))
+        return lines
+
+
+def upload_tree(outdir, url, connections=4, bundles=False, retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT,
+                headers=None, logger=None, metrics=None):
+    '''
+    Upload the sorted files in outdir that have not been sent to url
+    before, up to connections at once, and return an UploadResult.
+    Stopping it with Ctrl+C keeps the record of what has been sent.
+    '''
+    if logger is None:
+        logger = log
+    if metrics is None:
+        metrics = sidmetrics.Metrics()
+    # .../upload and .../upload/ are the same place
+    url = url.rstrip('/')
+    result = UploadResult(metrics)
+    listing = logger.isEnabledFor(logging.DEBUG)
+    Sender = Uploader(url, retries, backoff, timeout, headers, metrics)
+    Index = sidindex.SortIndex(outdir)
+    try:
+        pending = []
+        with metrics.timer('walk'):
+            for path, name, st in SortedFiles(outdir, bundles):
+                if Index.uploaded(path, url, st):
+                    result.unchanged += 1
+                    metrics.count('unchanged', name)
+                else:
+                    pending.append((path, name, st))
+        logger.info('%s files to upload, %s already uploaded', len(pending), result.unchanged)
+        StartTime = time.perf_counter()
+        saved = time.monotonic()
+        pool = ThreadPoolExecutor(max_workers=max(1, connections))
+        try:
+            futures = {pool.submit(Sender.send, path, name, st.st_size): (path, name, st)
+                       for path, name, st in pending}
+            for future in as_completed(futures):
+                path, name, st = futures[future]
+                try:
+                    seconds, tries = future.result()
+                except UploadError as e:
+                    result.failed.append((name, str(e)))
+                    metrics.count('failed', name)
+                    logger.warning('%s', e)
+                    continue
+                Index.record_upload(path, url, st)
+                result.uploaded += 1
+                result.retries += tries - 1
+                result.bytes += st.st_size
+                result.latencies.append(seconds)
+                metrics.count('uploaded', name)
+                metrics.add_bytes(st.st_size)
+                if listing:
+                    logger.debug('%s uploaded in %.3f seconds%s', name, seconds,
+                                 '' if tries == 1 else ', {} tries'.format(tries))
+                if time.monotonic() - saved > COMMIT_SECONDS:
+                    Index.commit()
+                    saved = time.monotonic()
+        finally:
+            # files not started yet are left for the next run
+            pool.shutdown(wait=True, cancel_futures=True)
+            result.seconds = time.perf_counter() - StartTime
+    finally:
+        Sender.close()
+        Index.close()
+    return result
+
+
+def Header(text):
+    '''A 'Name: value' command line argument as (name, value).'''
+    key, colon, value = text.partition(':')
+    if not colon or not key.strip():
+        raise argparse.ArgumentTypeError('Headers are given as "Name: value", not {}'.format(text))
+    return key.strip(), value.strip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Upload the sorted SID data files to the data portal')
+    parser.add_argument('-o', '--o', dest='outdir', default='./',
+                        help='Sorted files directory default is ./')
+    parser.add_argument('-u', '--url', dest='url', required=True,
+                        help='Address the files are uploaded under, each at its path in the sorted tree')
+    parser.add_argument('-c', '--connections', dest='connections', type=int, default=4,
+                        help='Number of files to upload at once, each over a connection of its own, default is 4')
+    parser.add_argument('--bundles', dest='bundles', action='store_true',
+                        help='Upload the day bundles made by sidbundle.py rather than the files')
+    parser.add_argument('--retries', dest='retries', type=int, default=RETRIES,
+                        help='Number of times to try a file again, default is {}'.format(RETRIES))
+    parser.add_argument('--backoff', dest='backoff', type=float, default=BACKOFF,
+                        help='Seconds to wait before trying again, doubled each time, default is {}'.format(BACKOFF))
+    parser.add_argument('--timeout', dest='timeout', type=float, default=TIMEOUT,
+                        help='Seconds to wait for the portal, default is {}'.format(TIMEOUT))
+    parser.add_argument('-H', '--header', dest='headers', type=Header, action='append', default=[],
+                        help='An extra HTTP header for every upload, such as "Authorization: Bearer ..."')
+    parser.add_argument('--log-level', dest='loglevel', default='INFO',
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help='DEBUG lists every file, INFO only the totals, '
+                             'WARNING only problems, default is INFO')
+    parser.add_argument('--metrics-json', dest='metricsjson',
+                        help='Save counts, timings and percentiles of the run to this JSON file')
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stdout, format='%(message)s', level=args.loglevel)
+
+    log.info('Sidupload version %s started %s', version, datetime.datetime.now().time())
+    if not os.path.isdir(args.outdir):
+        log.error('Sorted files directory does not exist: %s', args.outdir)
+        return 1
+    try:
+        result = upload_tree(args.outdir, args.url, args.connections, args.bundles, args.retries, args.backoff,
+                             args.timeout, dict(args.headers))
+    except ValueError as e:
+        log.error('%s', e)
+        return 1
+    except KeyboardInterrupt:
+        log.info('Stopped, the files sent so far are recorded')
+        return 1
+    Metrics = result.metrics
+    Metrics.finish()
+    log.info('Sidupload finished at %s', datetime.datetime.now().time())
+    for line in result.summary():
+        log.info(line)
+    if args.metricsjson:
+        Metrics.save(args.metricsjson, version=version, output=args.outdir, url=args.url,
+                     connections=args.connections, retries=result.retries, upload_seconds=result.seconds,
+                     latency=sidmetrics.Percentiles(result.latencies), failed=result.failed)
+        log.info('Run statistics saved to %s', args.metricsjson)
+    if result.failed:
+        log.error('%s files could not be uploaded', len(result.failed))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+'''
+###  sidwalk.py
+###  Input folder walker used by sidplan.MakePlan
+###
+###**************************
+###  Walk() lists the input tree with os.scandir, so the file type and, on
+###  Windows, the size and times of each file come with the listing instead
+###  of needing a stat for each one. Folders are listed on a pool of threads,
+###  which helps a lot on network mounts where every listing waits on the
+###  server. The folders are always given back in the same order (breadth
+###  first, each folder's files in the order the OS lists them) whatever the
+###  number of threads.
+###
+###  The output tree is never walked. If the output folder is inside the
+###  input folder it is left out. If they are the same folder, which is the
+###  default for both scripts, the year folders that look like sorted output
+###  (YYYY holding YYMM folders of the same year) are left out instead.
+###
+###**************************
+'''
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# sorted output is in YYYY/YYMM/YYMMDD folders
+FourDigits = re.compile(r'\d{4}$')
+
+
+def Norm(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def OutputFolders(outdir):
+    '''
+    The folders to leave out when walking: outdir itself and the sorted
+    YYYY folders inside it.
+    '''
+    prune = {Norm(outdir)}
+    try:
+        with os.scandir(outdir) as years:
+            for year in years:
+                if not FourDigits.match(year.name) or not year.is_dir(follow_symlinks=False):
+                    continue
+                try:
+                    with os.scandir(year.path) as months:
+                        if any(FourDigits.match(month.name) and month.name[:2] == year.name[2:]
+                               and month.is_dir(follow_symlinks=False) for month in months):
+                            prune.add(Norm(year.path))
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return prune
+
+
+def ScanDir(path, prune):
+    '''
+    List one folder. Returns (path, folders to walk next, DirEntry of each file).
+    Unreadable folders are treated as empty, as os.walk does.
+    '''
+    dirs = []
+    files = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    files.append(entry)
+                # like os.walk, do not follow links to other folders
+                elif not entry.is_symlink() and Norm(entry.path) not in prune:
+                    dirs.append(entry.path)
+    except OSError:
+        pass
+    return path, dirs, files
+
+
+def Walk(top, outdir=None, workers=1):
+    '''
+    Yield (folder, files) for every folder under top, where files is a list
+    of os.DirEntry. The output tree under outdir is left out.
+    '''
+    prune = OutputFolders(outdir) if outdir is not None else set()
+    # the top folder is always walked, even when it is also the output folder
+    prune.discard(Norm(top))
+    if workers <= 1:
+        pending = deque([top])
+        while pending:
+            subdir, dirs, files = ScanDir(pending.popleft(), prune)
+            pending.extend(dirs)
+            yield subdir, files
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque([pool.submit(ScanDir, top, prune)])
+        while pending:
+            subdir, dirs, files = pending.popleft().result()
+            # start listing the folders below while this one is planned
+            for path in dirs:
+                pending.append(pool.submit(ScanDir, path, prune))
+            yield subdir, files
@@ -0,0 +1,401 @@
+'''
+###  sidwatch.py
+###  Watch the input folder and hand new files to the sort as they arrive
+###
+###**************************
+###  Used by sidsort.py --watch. A watcher finds files that are created or
+###  written in the input tree:
+###    inotify - on Linux the kernel says which folder changed, through
+###              inotify called with ctypes, so nothing is listed again
+###    polling - everywhere else, and on network mounts where inotify does
+###              not see writes made by other machines.  Only the folders
+###              whose mtime has changed since the last look are listed.
+###  The output tree is left out in the same way as sidwalk.Walk.
+###
+###  New files are held by a Settler until their size and mtime have not
+###  changed for 'settle' seconds, so a file still being uploaded is never
+###  copied half written. With inotify a file is also held for as long as
+###  it is open for writing, however long the upload stalls: it is only
+###  looked at once the kernel says it has been closed (IN_CLOSE_WRITE) or
+###  renamed into place. Whatever is ready at each look is sorted together
+###  as one batch. Should a file change again after it has been sorted, it
+###  is sorted again and its copy replaced, see sidcopy.CopyQueue.
+###
+###**************************
+'''
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from collections import deque
+import sidwalk
+
+# seconds a file must go unchanged before it is sorted
+SETTLE = 5.0
+# seconds between looks at the input folder
+INTERVAL = 2.0
+# seconds a sorted file is still looked at by polling in case it changes again
+FOLLOW = 3600.0
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WatchMask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+# wd, mask, cookie, len - followed by len bytes of name
+EventHeader = struct.Struct('iIII')
+
+
+def LoadINotify():
+    '''The C library if it has inotify, else None.'''
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class Arrival:
+    '''
+    A file found by a watcher that has stopped changing. Has the name, path
+    and stat() of an os.DirEntry, so it can be given to sidplan.PlanFiles.
+    '''
+
+    __slots__ = ('path', 'name', 'st')
+
+    def __init__(self, path, st):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.st = st
+
+    def stat(self):
+        return self.st
+
+
+class Settler:
+    '''
+    Holds files until their size and mtime have stayed the same for settle
+    seconds, and files still open for writing until they are closed.
+    '''
+
+    def __init__(self, settle=SETTLE):
+        self.settle = settle
+        # path -> (size, mtime_ns, time it last changed, still open for writing)
+        self.pending = {}
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, path, st=None, writing=False):
+        '''
+        A file has been created or written. Its settle time starts again
+        even if it was already waiting. writing=True says it is still open
+        for writing, and it is held until it is added again without.
+        '''
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                self.pending.pop(path, None)
+                return
+        self.pending[path] = (st.st_size, st.st_mtime_ns, time.monotonic(), writing)
+
+    def ready(self):
+        '''
+        Take the files that have not changed for settle seconds, as Arrivals
+        in the order they were added. Only files whose time is up are
+        looked at again.
+        '''
+        now = time.monotonic()
+        batch = []
+        for path, (size, mtime, changed, writing) in list(self.pending.items()):
+            if writing or now - changed < self.settle:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                # gone, or moved away before it was sorted
+                del self.pending[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime):
+                # still growing
+                self.pending[path] = (st.st_size, st.st_mtime_ns, now, False)
+                continue
+            del self.pending[path]
+            batch.append(Arrival(path, st))
+        return batch
+
+
+class PollWatcher:
+    '''
+    Finds new files by listing again only the folders whose mtime has
+    changed. Files rewritten in place under the same name do not change
+    their folder, so the files sorted in the last FOLLOW seconds are looked
+    at again each time as well, in case an upload carried on after a stall.
+    '''
+
+    kind = 'polling'
+
+    def __init__(self, top, outdir, wanted):
+        self.top = top
+        self.outdir = outdir
+        self.wanted = wanted
+        self.prune = set()
+        # folder -> (mtime_ns, names of the files in it)
+        self.folders = {}
+        # path -> (size, mtime_ns, time it was sorted) of the files sorted lately
+        self.following = {}
+
+    def follow(self, batch):
+        '''Look out for the Arrivals just sorted changing again.'''
+        now = time.monotonic()
+        for arrival in batch:
+            self.following[arrival.path] = (arrival.st.st_size, arrival.st.st_mtime_ns, now)
+
+    def scan(self):
+        '''List the whole input tree. Returns the path of every wanted file.'''
+        self.prune = sidwalk.OutputFolders(self.outdir)
+        self.prune.discard(sidwalk.Norm(self.top))
+        self.folders = {}
+        return self._walk(self.top)
+
+    def _walk(self, top):
+        found = []
+        pending = deque([top])
+        while pending:
+            folder = pending.popleft()
+            # the time is read before the listing so nothing added during it is missed
+            mtime = self._mtime(folder)
+            if mtime is False:
+                continue
+            subdir, dirs, files = sidwalk.ScanDir(folder, self.prune)
+            pending.extend(dirs)
+            self.folders[folder] = (mtime, {entry.name for entry in files})
+            found.extend(entry.path for entry in files if entry.name[-3:] in self.wanted)
+        return found
+
+    @staticmethod
+    def _mtime(folder):
+        '''
+        The folder's mtime, None if it changed so recently that another file
+        could arrive within the same tick of the clock, or False if it is gone.
+        '''
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            return False
+        if time.time_ns() - mtime < 2 * 10**9:
+            return None
+        return mtime
+
+    def changes(self, timeout):
+        '''
+        Wait timeout seconds, then return (path, False) for any new files:
+        whether one is still being written can not be told by polling.
+        '''
+        time.sleep(timeout)
+        found = []
+        now = time.monotonic()
+        for path, (size, mtime, when) in list(self.following.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is None or now - when > FOLLOW:
+                del self.following[path]
+            elif (st.st_size, st.st_mtime_ns) != (size, mtime):
+                del self.following[path]
+                found.append((path, False))
+        outdir = sidwalk.Norm(self.outdir)
+        for folder, (mtime, names) in list(self.folders.items()):
+            now = self._mtime(folder)
+            if now is False:
+                del self.folders[folder]
+                continue
+            if now is not None and now == mtime:
+                continue
+            subdir, dirs, files = sidwalk.ScanDir(folder, self.prune)
+            self.folders[folder] = (now, {entry.name for entry in files})
+            found.extend((entry.path, False) for entry in files
+                         if entry.name not in names and entry.name[-3:] in self.wanted)
+            for path in dirs:
+                if path in self.folders:
+                    continue
+                if sidwalk.Norm(folder) == outdir:
+                    # might be a new year folder made by the sort itself
+                    self.prune |= sidwalk.OutputFolders(self.outdir)
+                    if sidwalk.Norm(path) in self.prune:
+                        continue
+                found.extend((path, False) for path in self._walk(path))
+        return found
+
+    def close(self):
+        pass
+
+
+class INotifyWatcher:
+    '''
+    Finds new files from inotify events, with a watch on every input folder.
+    '''
+
+    kind = 'inotify'
+
+    def __init__(self, top, outdir, wanted, libc):
+        self.top = top
+        self.outdir = outdir
+        self.wanted = wanted
+        self.libc = libc
+        self.prune = set()
+        # watch descriptor -> folder
+        self.folders = {}
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def scan(self):
+        '''
+        Watch and list the whole input tree. Returns the path of every wanted
+        file. Raises OSError if a folder cannot be watched, such as when the
+        system limit on watches is reached.
+        '''
+        self.prune = sidwalk.OutputFolders(self.outdir)
+        self.prune.discard(sidwalk.Norm(self.top))
+        return self._walk(self.top)
+
+    def _walk(self, top):
+        found = []
+        pending = deque([top])
+        while pending:
+            folder = pending.popleft()
+            # the watch goes on before the listing so nothing added during it is missed
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), WatchMask)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == 2:
+                    # ENOENT: removed since it was listed
+                    continue
+                raise OSError(err, os.strerror(err), folder)
+            self.folders[wd] = folder
+            subdir, dirs, files = sidwalk.ScanDir(folder, self.prune)
+            pending.extend(dirs)
+            found.extend(entry.path for entry in files if entry.name[-3:] in self.wanted)
+        return found
+
+    def changes(self, timeout):
+        '''
+        Wait up to timeout seconds for events, then return (path, writing)
+        for the files created or written: writing is False once the file
+        has been closed after writing, or renamed into the folder.
+        '''
+        found = []
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return found
+        data = b''
+        while True:
+            try:
+                data += os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+        outdir = sidwalk.Norm(self.outdir)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EventHeader.unpack_from(data, offset)
+            offset += EventHeader.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, so look at everything again
+                found.extend((path, False) for path in self.scan())
+                continue
+            if mask & IN_IGNORED:
+                self.folders.pop(wd, None)
+                continue
+            folder = self.folders.get(wd)
+            if folder is None:
+                continue
+            path = os.path.join(folder, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    if sidwalk.Norm(folder) == outdir:
+                        # might be a new year folder made by the sort itself
+                        self.prune |= sidwalk.OutputFolders(self.outdir)
+                    if sidwalk.Norm(path) not in self.prune:
+                        found.extend((path, False) for path in self._walk(path))
+            elif name[-3:] in self.wanted:
+                found.append((path, not mask & (IN_CLOSE_WRITE | IN_MOVED_TO)))
+        return found
+
+    def follow(self, batch):
+        # a file written again is seen from its events
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+def NewWatcher(top, outdir, wanted, poll=False):
+    '''
+    Make a watcher for top and scan it. Uses inotify unless poll is True or
+    it cannot be used here. Returns the watcher and the path of every wanted
+    file already in the tree.
+    '''
+    libc = None if poll else LoadINotify()
+    if libc is not None:
+        try:
+            watcher = INotifyWatcher(top, outdir, wanted, libc)
+        except OSError:
+            watcher = None
+        if watcher is not None:
+            try:
+                return watcher, watcher.scan()
+            except OSError:
+                watcher.close()
+    watcher = PollWatcher(top, outdir, wanted)
+    return watcher, watcher.scan()
+
+
+def Watch(top, outdir, wanted, sort, settle=SETTLE, interval=INTERVAL, known=None, poll=False,
+          started=None, stop=None):
+    '''
+    Sort files as they arrive in top until stop (a threading.Event) is set,
+    or for ever. sort(batch) is called with a list of Arrivals each time some
+    files have stopped changing. The files already in top are handled the
+    same way, apart from those known(path, st) says are already sorted.
+    started(watcher) is called once the tree has been scanned.
+    '''
+    watcher, paths = NewWatcher(top, outdir, wanted, poll)
+    try:
+        if started is not None:
+            started(watcher)
+        settler = Settler(settle)
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if known is None or not known(path, st):
+                settler.add(path, st)
+        while stop is None or not stop.is_set():
+            for path, writing in watcher.changes(interval):
+                settler.add(path, writing=writing)
+            batch = settler.ready()
+            if batch:
+                sort(batch)
+                watcher.follow(batch)
+    finally:
+        watcher.close()
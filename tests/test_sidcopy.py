@@ -0,0 +1,123 @@
+'''
+###  test_sidcopy.py
+###  sidcopy.CopyQueue with --verify, for files that meet in one run, and
+###  sidcopy.Atomic over a temporary name a stopped run left behind
+###
+###**************************
+###  Usage: py -m unittest discover -s tests
+###  or py -m pytest tests
+###
+###**************************
+'''
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sidcopy
+import sidindex
+
+
+class VerifyInOneRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.outdir = os.path.join(self.root, 'out')
+        self.day = os.path.join(self.outdir, '2019', '1901', '190101')
+        os.makedirs(self.day)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def source(self, name, data):
+        path = os.path.join(self.root, name)
+        with open(path, 'w') as f:
+            f.write(data)
+        return path
+
+    def sort(self, files, workers, on_conflict='version'):
+        '''Queue (source, NewFileName) in turn and return the outcomes.'''
+        index = sidindex.SortIndex(self.outdir)
+        Copier = sidcopy.CopyQueue(workers, index=index, verify=True, on_conflict=on_conflict)
+        try:
+            outcomes = [Copier.add(source, self.day, NewFileName, os.path.basename(source))
+                        for source, NewFileName in files]
+            Copier.finish()
+        finally:
+            index.close()
+        return outcomes, Copier
+
+    def read(self, name):
+        with open(os.path.join(self.day, name)) as f:
+            return f.read()
+
+    def test_conflict_versioned(self):
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                files = [(self.source('a{}.dat'.format(workers), 'one{}'.format(workers)), 'UT{}.dat'.format(workers)),
+                         (self.source('b{}.dat'.format(workers), 'two{}'.format(workers)), 'UT{}.dat'.format(workers))]
+                outcomes, Copier = self.sort(files, workers)
+                self.assertEqual(outcomes, [sidcopy.COPIED, sidcopy.VERSIONED])
+                self.assertEqual(self.read('UT{}.dat'.format(workers)), 'one{}'.format(workers))
+                self.assertEqual(self.read('UT{}_v2.dat'.format(workers)), 'two{}'.format(workers))
+
+    def test_conflict_flagged(self):
+        files = [(self.source('a.dat', 'one'), 'UT.dat'), (self.source('b.dat', 'two'), 'UT.dat')]
+        outcomes, Copier = self.sort(files, 4, on_conflict='flag')
+        self.assertEqual(outcomes, [sidcopy.COPIED, sidcopy.CONFLICT])
+        self.assertEqual(sorted(os.listdir(self.day)), ['UT.dat'])
+
+    def test_same_data_same_name_identical(self):
+        files = [(self.source('a.dat', 'one'), 'UT.dat'), (self.source('b.dat', 'one'), 'UT.dat')]
+        outcomes, Copier = self.sort(files, 4)
+        self.assertEqual(outcomes, [sidcopy.COPIED, sidcopy.IDENTICAL])
+        self.assertEqual(sorted(os.listdir(self.day)), ['UT.dat'])
+
+    def test_duplicate_of_queued_file(self):
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                files = [(self.source('a{}.dat'.format(workers), 'three{}'.format(workers)), 'UTa{}.dat'.format(workers)),
+                         (self.source('c{}.dat'.format(workers), 'three{}'.format(workers)), 'UTc{}.dat'.format(workers))]
+                outcomes, Copier = self.sort(files, workers)
+                self.assertEqual(outcomes, [sidcopy.COPIED, sidcopy.DUPLICATE])
+                self.assertEqual(Copier.twin, '{}/UTa{}.dat'.format(self.day, workers))
+                self.assertFalse(os.path.exists(os.path.join(self.day, 'UTc{}.dat'.format(workers))))
+
+
+class AtomicTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def file(self, name, data):
+        path = os.path.join(self.root, name)
+        with open(path, 'w') as f:
+            f.write(data)
+        return path
+
+    def test_stale_link_left_alone(self):
+        # a stopped hardlink run with this id left its temporary name linked to another file
+        other = self.file('other.dat', 'other')
+        source = self.file('source.dat', 'new')
+        destination = os.path.join(self.root, 'UT.dat')
+        for mode in sidcopy.Modes[:3]:
+            with self.subTest(mode=mode):
+                os.link(other, sidcopy.PartName(destination))
+                sidcopy.Atomic(partial(sidcopy.Transfers[mode], source), destination)
+                with open(destination) as f:
+                    self.assertEqual(f.read(), 'new')
+                with open(other) as f:
+                    self.assertEqual(f.read(), 'other')
+                self.assertEqual(sorted(os.listdir(self.root)), ['UT.dat', 'other.dat', 'source.dat'])
+                os.unlink(destination)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+'''
+###  test_sidupload.py
+###  sidupload.upload_tree against a stand-in portal on this machine
+###
+###**************************
+###  Usage: py -m unittest discover -s tests
+###  or py -m pytest tests
+###
+###  The stand-in is a ThreadingHTTPServer that keeps what is PUT to it.
+###  It turns away the first try at each file with 503 and Retry-After 0,
+###  always answers 503 for a path with 'busy' in it and 403 for one with
+###  'bad' in it.
+###
+###**************************
+'''
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sidupload
+
+
+class Portal(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_PUT(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        with server.lock:
+            server.tries[self.path] += 1
+            first = server.tries[self.path] == 1
+        if first or 'busy' in self.path:
+            self.answer(503, {'Retry-After': '0'})
+        elif 'bad' in self.path:
+            self.answer(403)
+        else:
+            with server.lock:
+                server.received[self.path] = data
+            self.answer(201)
+
+    def answer(self, status, headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class UploadTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Portal)
+        self.server.lock = threading.Lock()
+        self.server.tries = Counter()
+        self.server.received = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/upload/'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.outdir)
+
+    def sorted_file(self, name, data):
+        daydir = os.path.join(self.outdir, '2019', '1901', '190101')
+        os.makedirs(daydir, exist_ok=True)
+        with open(os.path.join(daydir, name), 'wb') as f:
+            f.write(data)
+
+    def upload(self):
+        return sidupload.upload_tree(self.outdir, self.url, connections=2, retries=2, backoff=0)
+
+    def test_retried_until_taken(self):
+        self.sorted_file('UT190101_VLF_JCook.dat', b'dat')
+        self.sorted_file('UT190101_VLF_JCook.spd', b'spd')
+        result = self.upload()
+        self.assertEqual(result.uploaded, 2)
+        self.assertEqual(result.retries, 2)
+        self.assertEqual(result.failed, [])
+        self.assertEqual(result.bytes, 6)
+        self.assertEqual(self.server.received, {
+            '/upload/2019/1901/190101/UT190101_VLF_JCook.dat': b'dat',
+            '/upload/2019/1901/190101/UT190101_VLF_JCook.spd': b'spd',
+            })
+
+    def test_rerun_sends_only_changed_files(self):
+        self.sorted_file('UT190101_VLF_JCook.dat', b'dat')
+        self.sorted_file('UT190101_VLF_JCook.spd', b'spd')
+        self.upload()
+        result = self.upload()
+        self.assertEqual((result.uploaded, result.unchanged), (0, 2))
+        self.sorted_file('UT190101_VLF_JCook.dat', b'more dat')
+        result = sidupload.upload_tree(self.outdir, self.url.rstrip('/'), connections=2, retries=2, backoff=0)
+        self.assertEqual((result.uploaded, result.unchanged), (1, 1))
+        self.assertEqual(self.server.received['/upload/2019/1901/190101/UT190101_VLF_JCook.dat'], b'more dat')
+
+    def test_refused_file_is_failed_and_tried_next_run(self):
+        self.sorted_file('UT190101_VLF_bad.dat', b'dat')
+        self.sorted_file('UT190101_VLF_JCook.dat', b'dat')
+        result = self.upload()
+        self.assertEqual(result.uploaded, 1)
+        self.assertEqual([name for name, reason in result.failed], ['2019/1901/190101/UT190101_VLF_bad.dat'])
+        self.assertIn('403', result.failed[0][1])
+        result = self.upload()
+        self.assertEqual((result.uploaded, result.unchanged, len(result.failed)), (0, 1, 1))
+
+    def test_given_up_after_retries(self):
+        self.sorted_file('UT190101_VLF_busy.dat', b'dat')
+        result = self.upload()
+        self.assertEqual(result.uploaded, 0)
+        self.assertEqual(len(result.failed), 1)
+        self.assertEqual(self.server.tries['/upload/2019/1901/190101/UT190101_VLF_busy.dat'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
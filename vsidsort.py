@@ -20,14 +20,23 @@
 ###  v2.0a Added GUI and a few other features RGP
 ###  v2.1a Resolved YY and YYYY date formatting RGP
 ###  v2.2a Added csv files section
+###  v2.3a Files inside .zip archives are sorted too
+###  v2.4a Filename rules moved to sidplan.py
+###  v2.5a Sort runs in the background with a progress bar, full log in the output folder
+###  v2.6a Option to compare file contents, and keep changed files as new versions
+###  v2.7a The sort itself is sidsort.sort_tree, tkinter is only loaded when the window opens
 ###
 ###**************************
 '''
 import os, datetime, time
-import shutil
-from tkinter import *
-from tkinter import ttk, StringVar
-from tkinter.filedialog import askdirectory
+import logging
+import queue
+import threading
+import sidcopy
+import sidsort
+
+# loaded by main() when the window is opened, so importing this file stays quick
+tkinter = ttk = askdirectory = None
 
 version = '2.2a'
 Names = (
@@ -37,16 +46,47 @@ Names = (
         'AThomas'
         )
 version = '2.0a'
-folders = {'input':"./", 'output':"./"}
-labels={}
+# lines kept in the message window, older ones are only in the log file
+MaxLogLines = 2000
+# how often the window picks up messages and progress from the sort, in ms
+PollInterval = 100
+LogName = 'vsidsort.log'
+
+class WindowHandler(logging.Handler):
+    '''
+    Sends the messages from sidsort.sort_tree to the message window.
+    '''
+    
+    def __init__(self, app):
+        logging.Handler.__init__(self)
+        self.app = app
+        
+    def emit(self, record):
+        self.app.Log(self.format(record) + '\n')
 
 class Application:
     
     def __init__(self, parent):
         self.parent = parent
         parent.title( "vSIDSORT {}".format(version))
-        self.GUI()
+        self.folders = {'input':"./", 'output':"./"}
+        self.labels = {}
         self.SkippedFiles = []
+        # the sort's messages, one line per file, go to the message window
+        self.Logger = logging.getLogger('vsidsort')
+        self.Logger.setLevel(logging.DEBUG)
+        self.Logger.propagate = False
+        self.Logger.addHandler(WindowHandler(self))
+        # messages from the sort thread, None when it has finished
+        self.Updates = queue.Queue()
+        self.Worker = None
+        self.LogFile = None
+        # progress counters, written by the sort thread and read by Poll
+        self.Done = 0
+        self.Total = 0
+        self.CopyStart = 0
+        self.GUI()
+        self.Poll()
         
     def GUI(self):
         
@@ -60,7 +100,7 @@ class Application:
         self.OutputButton = ttk.Button(self.parent, text='Select output folder', width=20, command= lambda : self.GetFolder('output'))
         self.OutputButton.grid(column=0, row=1)
         
-        self.ObserverName = StringVar()
+        self.ObserverName = tkinter.StringVar()
         self.NameSelect = ttk.Combobox(self.parent, width = 30 , textvariable = self.ObserverName)
         self.NameSelect['values'] = Names
         self.NameSelect.current(0)
@@ -69,20 +109,51 @@ class Application:
         self.ObserverLabel = ttk.Label(self.parent, text ="Observer's Name")
         self.ObserverLabel.grid(column=0, row=2)
         
-        labels['input']=self.InputLabel
-        labels['output'] =self.OutputLabel
+        self.Workers = tkinter.StringVar(value='1')
+        self.WorkersSelect = ttk.Spinbox(self.parent, from_=1, to=64, width=5, textvariable = self.Workers)
+        self.WorkersSelect.grid(column=1, row=3, sticky='w')
+        
+        self.WorkersLabel = ttk.Label(self.parent, text ="Copy workers")
+        self.WorkersLabel.grid(column=0, row=3)
+        
+        self.Rescan = tkinter.BooleanVar(value=False)
+        self.RescanCheck = ttk.Checkbutton(self.parent, text='Re-check files sorted on earlier runs', variable = self.Rescan)
+        self.RescanCheck.grid(column=1, row=3, sticky='e')
+        
+        self.Mode = tkinter.StringVar()
+        self.ModeSelect = ttk.Combobox(self.parent, width = 10, textvariable = self.Mode, state='readonly')
+        self.ModeSelect['values'] = sidcopy.Modes
+        self.ModeSelect.current(0)
+        self.ModeSelect.grid(column=1, row=3)
+        
+        self.Verify = tkinter.BooleanVar(value=False)
+        self.Version = tkinter.BooleanVar(value=False)
+        self.VerifyFrame = ttk.Frame(self.parent)
+        self.VerifyCheck = ttk.Checkbutton(self.VerifyFrame, text='Compare file contents', variable = self.Verify)
+        self.VerifyCheck.grid(column=0, row=0, sticky='w')
+        self.VersionCheck = ttk.Checkbutton(self.VerifyFrame, text='Keep changed files as _v2, _v3...', variable = self.Version)
+        self.VersionCheck.grid(column=1, row=0, sticky='w')
+        self.VerifyFrame.grid(column=1, row=2, sticky='e')
+        
+        self.labels['input']=self.InputLabel
+        self.labels['output'] =self.OutputLabel
         
         self.RunButton = ttk.Button(self.parent, text='Run', width=20, command= self.Sort)
         self.RunButton.grid(column=0, row=4, sticky='s')
         
-        self.S = Scrollbar(root)
-        self.Messages = Text(self.parent, height=40, width=150)
+        self.S = tkinter.Scrollbar(self.parent)
+        self.Messages = tkinter.Text(self.parent, height=40, width=150)
         self.S.grid(column=2, row=4, sticky='ns')
         self.Messages.grid(column=1, row=4, columnspan=True)
         self.S.config(command=self.Messages.yview)
         self.Messages.config(yscrollcommand=self.S.set)
         self.Messages.bind('<Button-3>',self.rClicker, add='')
         
+        self.Progress = ttk.Progressbar(self.parent, orient='horizontal', mode='determinate')
+        self.Progress.grid(column=1, row=5, sticky='ew')
+        self.Status = ttk.Label(self.parent, text='')
+        self.Status.grid(column=0, row=5)
+        
         self.style = ttk.Style()
         self.style.theme_use("vista") # classic,default,clam,winnative,vista,xpnative,alt  
 
@@ -107,13 +178,13 @@ class Application:
                    (' Copy', lambda e=e: rClick_Copy(e)),
                    ]
     
-            rmenu = Menu(None, tearoff=0, takefocus=0)
+            rmenu = tkinter.Menu(None, tearoff=0, takefocus=0)
     
             for (txt, cmd) in nclst:
                 rmenu.add_command(label=txt, command=cmd)
     
             rmenu.tk_popup(e.x_root+40, e.y_root+10,entry="0")
-        except TclError:
+        except tkinter.TclError:
             print(' - rClick menu, something wrong')
             pass
         return "break"              
@@ -124,194 +195,179 @@ class Application:
         try:
             for b in [ 'Text', 'Entry', 'Listbox', 'Label']: #
                 r.bind_class(b, sequence='<Button-3>', func=self.rClicker, add='')
-        except TclError:
+        except tkinter.TclError:
             print(' - rClickbinder, something wrong') 
 
 
-    def CopyFile(self):
-        '''
-        Rename the file to meet the following specification:
-        The VLF Data Repository naming convention is UTYYYYMMDD[0HHSS]_VLF_[Name].[Suffix]
-        '''
-        # Make sure the skipped file list is cleared
-        self.SkippedFiles.clear()
-        # Get the filenames from the input directory
-        FileNames = os.listdir(folders['input'])
-        # numfiles stores how many files are copied
-        numfiles = 0
-        # Loop through all the names and process them - including all subdirectories
-        for subdir, dirs, files in os.walk(folders['input']):
-            for file in files:
-                suffix = file[-3:]
-                # only process .dat file types, skip any other non .dat files
-                if suffix == 'dat':            
-                    longyear = file[0:4]
-                    year = file[2:4]
-                    month = file[4:6]
-                    date = file[6:8]
-                    # make the new directory path based on the file information
-                    NewDir = '{0}/{1}/{2}{3}/{2}{3}{4}'.format(folders['output'], longyear, year, month, date)
-                    # check the directory exists and if it does not then create it
-                    if not os.path.exists(NewDir):
-                        os.makedirs(NewDir)    
-                    
-                    # Create the new file name
-                    # NewFileName = 'UT{0}{1}{2}_VLF_{3}.dat'.format(year, month, date, name)
-                    # Edited by AJL to concert filename to long year format, for conformity to SPD file convention
-                    NewFileName = 'UT{0}{1}{2}_VLF_{3}.dat'.format(longyear, month, date, self.ObserverName.get())
-                    
-                    # copy the file to the new directory so long as it does not already exist
-                    if not os.path.isfile('{}/{}'.format(NewDir, NewFileName)):
-                        numfiles += 1
-                        # copy and rename the file to the new location
-                        shutil.copy(os.path.join(subdir, file), '{}/{}'.format(NewDir, NewFileName))
-                        self.Messages.insert(END, '{} >> {} copied to {}\n'.format(file, NewFileName, NewDir))
-                    else:
-                        self.Messages.insert(END, '{0}/{1} - File already exists!\n'.format( NewDir, NewFileName))
-                elif suffix == 'spd':
-                    NewFileName = '{}_VLF_{}.spd'.format(file[2:-4], self.ObserverName.get())
-                    # Detect either YY or YYYY date format
-                    if file[2:4] == '20':
-                        year = '{}'.format(file[2:6])
-                        NewFileName = "UT{}".format(NewFileName)
-                        month = file[6:8]
-                        date = file[8:10]
-                    else:                    
-                        year = '20{}'.format(file[2:4])
-                        NewFileName = "UT20{}".format(NewFileName)
-                        month = file[4:6]
-                        date = file[6:8]
-                    # make the new directory path based on the file information
-                    NewDir = '{0}/{1}/{2}{3}/{2}{3}{4}'.format(folders['output'], year, year[-2:], month, date)
-                    # check the directory exists and if it does not then create it
-                    if not os.path.exists(NewDir):
-                        os.makedirs(NewDir)    
-                                  
-                    # copy the file to the new directory so long as it does not already exist
-                    if not os.path.isfile('{}/{}'.format(NewDir, NewFileName)):
-                        numfiles += 1
-                        # copy and rename the file to the new location
-                        shutil.copy(os.path.join(subdir, file), '{}/{}'.format(NewDir, NewFileName))
-                        self.Messages.insert(END, '{} >> {} copied to {}\n'.format(file, NewFileName, NewDir))
-                    else:
-                        self.Messages.insert(END, '{0}/{1} - File already exists!\n'.format( NewDir, NewFileName))
-                    
-                    pass
-                elif suffix == 'xml':
-                    '''
-                        File example for Andrew Thomas: Staribus4ChannelLogger_RawData_20190101_000021.xml
-                    '''
-                    FilenameParts = file.split('_')
-                    NewFileName = 'UT{}_{}_{}_{}_VLF_{}.xml'.format(FilenameParts[2], FilenameParts[3][:-4],
-                                                               FilenameParts[0], FilenameParts[1], self.ObserverName.get())
-                    #print(NewFileName)
-                    year = '{}'.format(FilenameParts[2][2:4])
-                    month = FilenameParts[2][4:6]
-                    date = FilenameParts[2][6:8]
-                    # make the new directory path based on the file information
-                    NewDir = '{0}/20{1}/{2}{3}/{2}{3}{4}'.format(folders['output'], year, year, month, date)
-                    # check the directory exists and if it does not then create it
-                    if not os.path.exists(NewDir):
-                        os.makedirs(NewDir)    
-                                  
-                    # copy the file to the new directory so long as it does not already exist
-                    if not os.path.isfile('{}/{}'.format(NewDir, NewFileName)):
-                        numfiles += 1
-                        # copy and rename the file to the new location
-                        shutil.copy(os.path.join(subdir, file), '{}/{}'.format(NewDir, NewFileName))
-                        self.Messages.insert(END, '{} >> {} copied to {}\n'.format(file, NewFileName, NewDir))
-                elif suffix == 'csv':
-                    '''
-                        Example file: UT20110307_UKRAA_Rx_VLF_SDawes.csv
-                    '''
-                    NewFileName = file
-                    #print(NewFileName)
-                    year = file[2:6]
-                    month = file[6:8]
-                    date = file[8:10]
-                    # make the new directory path based on the file information
-                    NewDir = '{0}/{1}/{2}{3}/{2}{3}{4}'.format(folders['output'], year, year[-2:], month, date)
-                    # check the directory exists and if it does not then create it
-                    if not os.path.exists(NewDir):
-                        os.makedirs(NewDir)    
-                                  
-                    # copy the file to the new directory so long as it does not already exist
-                    if not os.path.isfile('{}/{}'.format(NewDir, NewFileName)):
-                        numfiles += 1
-                        # copy and rename the file to the new location
-                        shutil.copy(os.path.join(subdir, file), '{}/{}'.format(NewDir, NewFileName))
-                        self.Messages.insert(END, '{} >> {} copied to {}\n'.format(file, NewFileName, NewDir))                        
-                    else:
-                        self.Messages.insert(END, '{0}/{1} - File already exists!\n'.format( NewDir, NewFileName))
-                    
-                    pass
-                else:
-                    # not a .dat or .spd file!
-                    #self.Messages.insert(END, '{} skipped\n'.format(file))
-                    self.SkippedFiles.append(file)
-            
-        return numfiles
-
     def GetFolder(self, folder_type, event=None):
         '''
             Folder type is 'input' or 'output'
         '''
-        folders[folder_type] = askdirectory(initialdir="",
+        self.folders[folder_type] = askdirectory(initialdir="",
                                title = "Choose the input directory."
                                )
-        labels[folder_type].config(text=folders[folder_type])
-        self.Messages.insert(END, "{} folder set to {}\n".format(folder_type.capitalize(), folders[folder_type]))
+        self.labels[folder_type].config(text=self.folders[folder_type])
+        self.Log("{} folder set to {}\n".format(folder_type.capitalize(), self.folders[folder_type]))
         #Using try in case user types in unknown file or closes without choosing a file.
 
     def Sort(self):
-        self.Messages.insert(END, 'SORTING for {}...\n'.format(self.ObserverName.get()))
-        #Messages.insert(END, 'From: {} \nTo: {}\n'.format(folders['input'], folders['output']))
-        #Messages.insert(END, 'For: {}\n'.format(Name.get()))
+        # only one sort at a time
+        if self.Worker is not None and self.Worker.is_alive():
+            return
+        self.Log('SORTING for {}...\n'.format(self.ObserverName.get()))
         StartTime = time.time()
-        self.Messages.insert(END, 'Sidsort version {} started {}\n'.format(version, datetime.datetime.now().time()))
+        self.Log('Sidsort version {} started {}\n'.format(version, datetime.datetime.now().time()))
         
         # make sure the input directory exists
-        if folders['input'] and os.path.isdir(folders['input']) is True:
-            self.Messages.insert(END, 'Sorting files in {}\n'.format(folders['input']))
+        if self.folders['input'] and os.path.isdir(self.folders['input']) is True:
+            self.Log('Sorting files in {}\n'.format(self.folders['input']))
         else:
-            self.Messages.insert(END, 'Input Directory does not exist: {}\n'.format(folders['input']))
+            self.Log('Input Directory does not exist: {}\n'.format(self.folders['input']))
             return
-        if not folders['output']:
-            self.Messages.insert(END, 'Output Directory blank!\n')
+        if not self.folders['output']:
+            self.Log('Output Directory blank!\n')
             return
-        self.Messages.insert(END, 'Outputting renamed files in {}\n'.format(folders['output']))
-        if not os.path.exists(folders['output']):
-            self.Messages.insert(END, "Output directory doesn't exist so creating it....\n")
-            os.makedirs(folders['output'])    
+        self.Log('Outputting renamed files in {}\n'.format(self.folders['output']))
+        if not os.path.exists(self.folders['output']):
+            self.Log("Output directory doesn't exist so creating it....\n")
+            os.makedirs(self.folders['output'])    
+        # the window only keeps the newest lines, the whole log goes to this file
+        self.LogFile = open(os.path.join(self.folders['output'], LogName), mode='at', encoding='utf-8')
+        self.Log('Full log = {}\n'.format(os.path.join(self.folders['output'], LogName)))
         
-        # call the copy function and get back the number of files copied    
-        numfiles = self.CopyFile()
-        # log any skipped files
-        if len(self.SkippedFiles):
-            self.Messages.insert(END, 'Skipped Files = {}\n'.format(len(self.SkippedFiles)))
-            self.WriteSkippedReport()
-        else:
-            self.Messages.insert(END, 'No Skipped Files\n')
-        # get the time now in order to calculate how long it all took
-        EndTime = time.time()
-        self.Messages.insert(END, 'Sidsort finished at {}\n'.format(datetime.datetime.now().time()))
-        self.Messages.insert(END, 'Files copied = {} in {:.3f} seconds\n'.format(numfiles, EndTime-StartTime))
+        # Tk variables must be read here, not on the sort thread
+        try:
+            workers = int(self.Workers.get())
+        except ValueError:
+            workers = 1
+        settings = (StartTime, self.ObserverName.get(), workers, self.Rescan.get(), self.Mode.get(),
+                    self.Verify.get(), 'version' if self.Version.get() else 'flag')
+        
+        self.Done = 0
+        self.Total = 0
+        self.RunButton.state(['disabled'])
+        # run the sort in the background so the window keeps responding
+        self.Worker = threading.Thread(target=self.SortWorker, args=settings, daemon=True)
+        self.Worker.start()
+
+    def SortWorker(self, StartTime, Observer, workers, rescan, mode, verify, on_conflict):
+        '''
+        The body of a sort, run on its own thread.
+        '''
+        try:
+            # sort the files and get back what was done
+            result = sidsort.sort_tree(self.folders['input'], self.folders['output'], Observer, rules = 'long',
+                                       workers = workers, rescan = rescan, mode = mode, verify = verify,
+                                       on_conflict = on_conflict, progress = self.Progressed, logger = self.Logger)
+            Metrics = result.metrics
+            Metrics.finish()
+            # Make sure the skipped file list only has this run's files
+            self.SkippedFiles = result.skipped + [os.path.basename(path) for path in result.badzips]
+            # log any skipped files
+            if len(self.SkippedFiles):
+                self.Log('Skipped Files = {}\n'.format(len(self.SkippedFiles)))
+                self.WriteSkippedReport()
+            else:
+                self.Log('No Skipped Files\n')
+            # get the time now in order to calculate how long it all took
+            EndTime = time.time()
+            self.Log('Sidsort finished at {}\n'.format(datetime.datetime.now().time()))
+            for line in Metrics.summary():
+                self.Log(line + '\n')
+            self.Log('Unchanged files passed over = {}\n'.format(result.unchanged))
+            self.Log('Files copied = {} in {:.3f} seconds\n'.format(result.copied, EndTime-StartTime))
+        except Exception as error:
+            self.Log('Sort stopped: {}\n'.format(error))
+        finally:
+            # tell Poll the sort is over
+            self.Updates.put(None)
         
         ### END OF THE SCRIPT - RETURN TO THE COMMAND PROMPT ###
         
+    def Progressed(self, done, total):
+        '''
+        Called by the sort, on the sort thread, once the number of files is
+        known and after each file. Poll shows the numbers.
+        '''
+        if not done:
+            # start the progress bar now the number of files is known
+            self.CopyStart = time.time()
+        self.Done = done
+        self.Total = total
+        
+    def Log(self, text):
+        '''
+        Add text to the message window. Safe to call from any thread, the
+        text is shown the next time Poll runs.
+        '''
+        self.Updates.put(text)
+
+    def Poll(self):
+        '''
+        Runs every PollInterval ms on the Tk thread: show the messages logged
+        since the last call in one go and update the progress bar.
+        '''
+        lines = []
+        finished = False
+        while True:
+            try:
+                line = self.Updates.get_nowait()
+            except queue.Empty:
+                break
+            if line is None:
+                finished = True
+            else:
+                lines.append(line)
+        if lines:
+            if self.LogFile is not None:
+                self.LogFile.write(''.join(lines))
+            # keep only the newest MaxLogLines lines on screen
+            self.Messages.insert(tkinter.END, ''.join(lines[-MaxLogLines:]))
+            excess = int(self.Messages.index('end-1c').split('.')[0]) - MaxLogLines
+            if excess > 0:
+                self.Messages.delete('1.0', '{}.0'.format(excess + 1))
+            self.Messages.see(tkinter.END)
+        self.ShowProgress()
+        if finished:
+            if self.LogFile is not None:
+                self.LogFile.close()
+                self.LogFile = None
+            self.RunButton.state(['!disabled'])
+        self.parent.after(PollInterval, self.Poll)
+
+    def ShowProgress(self):
+        if not self.Total:
+            self.Progress['value'] = 0
+            self.Status.config(text='')
+            return
+        self.Progress['maximum'] = self.Total
+        self.Progress['value'] = self.Done
+        rate = self.Done / max(time.time() - self.CopyStart, 1e-6)
+        if rate > 0:
+            eta = datetime.timedelta(seconds=int((self.Total - self.Done) / rate))
+        else:
+            eta = '--'
+        self.Status.config(text='{} of {} files  {:.0f} files/s  ETA {}'.format(self.Done, self.Total, rate, eta))
 
     def ClearText(self, event=None):
-        self.Messages.delete('1.0', END)
+        self.Messages.delete('1.0', tkinter.END)
 
     def WriteSkippedReport(self):
         ReportName = 'skipreport.log'
-        self.Messages.insert(END, 'Skipped File report = {}/{}\n'.format(folders['input'], ReportName))
-        with open('{}{}'.format(folders['input'], ReportName), mode='wt', encoding='utf-8') as myfile:
+        self.Log('Skipped File report = {}/{}\n'.format(self.folders['input'], ReportName))
+        with open('{}{}'.format(self.folders['input'], ReportName), mode='wt', encoding='utf-8') as myfile:
             myfile.write('\n'.join(self.SkippedFiles))
         
 
-if __name__ == '__main__':
-    root = Tk()
+def main():
+    global tkinter, ttk, askdirectory
+    import tkinter
+    from tkinter import ttk
+    from tkinter.filedialog import askdirectory
+    root = tkinter.Tk()
     app = Application(root)
     root.mainloop()
+
+if __name__ == '__main__':
+    main()
     
\ No newline at end of file